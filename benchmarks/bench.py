@@ -0,0 +1,340 @@
+"""Benchmarks of graph generation, cover assembly and the eigenvalue drivers.
+
+Usage:
+    python -m benchmarks.bench [--sizes 1000 10000] [--cover-degs 200 2000]
+        [--cases random_graph ...] [--output bench.json] [--compare old_bench.json]
+
+Each case is timed at every size V of the grid (the number of vertices of the
+graph) and every degree, in a fresh process so its peak RSS is its own. The
+covers of a fixed base graph are timed at every cover degree of the grid instead,
+and their size is the number of vertices of the cover. The results, throughputs and the log-log scaling exponent of each case
+are printed and saved as json, and --compare prints the ratio of every median
+time to the one of an earlier json file.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import time
+
+import numpy as np
+import scipy
+
+import random_graphs
+
+DEFAULT_SIZES = [1000, 10000, 100000, 500000]
+DEFAULT_DEGREES = [4, 8]
+DEFAULT_COVER_DEGS = [200, 2000, 20000, 100000]
+
+# The base graph of scripts/irreg_cover.py, the complete graph on 5 vertices
+# minus an edge
+K5_MINUS_EDGE = np.matrix(
+    [
+        [0.0, 1.0, 1.0, 1.0, 0.0],
+        [1.0, 0.0, 1.0, 1.0, 1.0],
+        [1.0, 1.0, 0.0, 1.0, 1.0],
+        [1.0, 1.0, 1.0, 0.0, 1.0],
+        [0.0, 1.0, 1.0, 1.0, 0.0],
+    ]
+)
+
+
+def _complete_graph(size):
+    return np.matrix(np.ones((size, size)) - np.eye(size))
+
+
+def _random_graph(size, deg, rng):
+    return lambda: random_graphs.random_graph(deg=deg, size=size, rng=rng)
+
+
+def _random_simple_graph(size, deg, rng):
+    return lambda: random_graphs.random_simple_graph(deg=deg, size=size, rng=rng)
+
+
+def _loop_cover(size, deg, rng):
+    base_graph = np.matrix([[deg]])
+    return lambda: random_graphs.random_cover(
+        base_graph=base_graph,
+        cover_deg=size,
+        permutation_func=random_graphs.permutations.uniform_permutation,
+        identity_shift=0,
+        rng=rng,
+    )
+
+
+def _complete_cover(cover_deg, deg, rng):
+    base_graph = _complete_graph(deg + 1)
+    return lambda: random_graphs.random_cover(
+        base_graph=base_graph,
+        cover_deg=cover_deg,
+        permutation_func=random_graphs.permutations.uniform_permutation,
+        identity_shift=0,
+        rng=rng,
+    )
+
+
+def _irreg_cover(cover_deg, deg, rng):
+    return lambda: random_graphs.random_cover(
+        base_graph=K5_MINUS_EDGE,
+        cover_deg=cover_deg,
+        permutation_func=random_graphs.permutations.uniform_permutation,
+        identity_shift=0,
+        rng=rng,
+    )
+
+
+def _matrix_rep_cover(size, deg, rng):
+    base_graph = random_graphs.random_simple_graph(deg=deg, size=size // 4, rng=rng)
+    return lambda: random_graphs.random_cover_matrix_rep(
+        base_graph=base_graph,
+        matrix_func=random_graphs.quaternion_matrix_rep,
+        identity_shift=0,
+        rng=rng,
+    )
+
+
+def _simple_permutations(size, deg, rng):
+    return lambda: random_graphs.permutations.simple_permutations(
+        size, deg // 2, rng=rng
+    )
+
+
+def _derangements_avoiding_others(size, deg, rng):
+    def func():
+        perms = []
+        for _ in range(deg // 2):
+            perms.append(
+                random_graphs.permutations.derangement_avoiding_others(
+                    size, perms, rng=rng
+                )
+            )
+        return perms
+
+    return func
+
+
+def _loop_eigs(size, deg, rng):
+    return lambda: random_graphs.generate_loop_extremal_eigs(
+        size=size,
+        deg=deg,
+        number=1,
+        eig_type="max_positive",
+        simple=True,
+        rng=rng,
+    )
+
+
+def _matrix_rep_eigs(size, deg, rng):
+    return lambda: random_graphs.generate_matrix_rep_eigs(
+        size=size // 4,
+        deg=deg,
+        number=1,
+        matrix_func=random_graphs.quaternion_matrix_rep,
+        eig_type="max_positive",
+        rng=rng,
+    )
+
+
+def _new_extremal_eigs(cover_deg, deg, rng):
+    base_graph = _complete_graph(deg + 1)
+    return lambda: random_graphs.generate_new_extremal_eigs(
+        base_graph=base_graph,
+        cover_deg=cover_deg,
+        permutation_func=random_graphs.permutations.uniform_permutation,
+        number=1,
+        trivial_eig=deg,
+        eig_type="max_positive",
+        rng=rng,
+    )
+
+
+def _complete_base_size(deg):
+    return deg + 1
+
+
+def _irreg_base_size(deg):
+    return K5_MINUS_EDGE.shape[0]
+
+
+# Each case maps to the function building the callable to time, the largest size
+# it runs at by default, and for the covers of a fixed base graph the function
+# giving the number of vertices of the base graph at a degree. Those cases are
+# built from the cover degree instead of the size. The eigenvalue drivers are too
+# slow for the top of the grid to be part of a routine run.
+CASES = {
+    "random_graph": (_random_graph, None, None),
+    "random_simple_graph": (_random_simple_graph, None, None),
+    "random_cover_loop": (_loop_cover, None, None),
+    "random_cover_complete": (_complete_cover, None, _complete_base_size),
+    "random_cover_irreg": (_irreg_cover, None, _irreg_base_size),
+    "random_cover_matrix_rep": (_matrix_rep_cover, 100000, None),
+    "simple_permutations": (_simple_permutations, None, None),
+    "derangement_avoiding_others": (_derangements_avoiding_others, 100000, None),
+    "generate_loop_extremal_eigs": (_loop_eigs, 100000, None),
+    "generate_matrix_rep_eigs": (_matrix_rep_eigs, 100000, None),
+    "generate_new_extremal_eigs": (_new_extremal_eigs, 100000, _complete_base_size),
+}
+
+
+def _case_key(result):
+    # Results saved before the cover degree was recorded have no cover_deg
+    return (result["case"], result["size"], result["deg"], result.get("cover_deg"))
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(name, size, deg, repeats, seed, cover_deg=None):
+    """Times repeats calls of case name at the given size and degree, or for the
+    covers of a fixed base graph at the given cover degree, whose cover has size
+    vertices. Meant to run in a fresh process, so the peak RSS belongs to this case
+    alone."""
+    rng = np.random.default_rng(seed)
+    baseline_rss = _peak_rss_mb()
+    func = CASES[name][0](size if cover_deg is None else cover_deg, deg, rng)
+    func()  # Warm up
+
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+
+    median = float(np.median(seconds))
+    return {
+        "case": name,
+        "size": size,
+        "deg": deg,
+        "cover_deg": cover_deg,
+        "seconds": seconds,
+        "median_seconds": median,
+        "min_seconds": min(seconds),
+        "calls_per_second": 1 / median,
+        "vertices_per_second": size / median,
+        "peak_rss_mb": _peak_rss_mb(),
+        "peak_rss_increase_mb": _peak_rss_mb() - baseline_rss,
+    }
+
+
+def scaling_exponents(results):
+    """Returns the slope of log(median time) against log(size) of each case and
+    degree, i.e. the exponent a of time ~ size^a."""
+    exponents = []
+    for name in dict.fromkeys(r["case"] for r in results):
+        for deg in dict.fromkeys(r["deg"] for r in results):
+            points = [
+                (r["size"], r["median_seconds"])
+                for r in results
+                if r["case"] == name and r["deg"] == deg
+            ]
+            if len(points) < 2:
+                continue
+            sizes, seconds = np.log(np.array(points)).T
+            exponent = np.polyfit(sizes, seconds, 1)[0]
+            exponents.append({"case": name, "deg": deg, "exponent": exponent})
+    return exponents
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _cover_deg_label(cover_deg):
+    return "" if cover_deg is None else f"cover_deg={cover_deg:<7} "
+
+
+def compare(results, old_results):
+    """Prints the ratio of each median time to the one of the same case in
+    old_results."""
+    old = {_case_key(r): r for r in old_results}
+    for r in results:
+        previous = old.get(_case_key(r))
+        if previous is None:
+            continue
+        ratio = r["median_seconds"] / previous["median_seconds"]
+        flag = "  SLOWER" if ratio > 1.2 else ""
+        print(
+            f"{r['case']:<30} V={r['size']:<8} deg={r['deg']:<3} "
+            f"{_cover_deg_label(r['cover_deg'])}"
+            f"{previous['median_seconds']:.4g}s -> {r['median_seconds']:.4g}s "
+            f"(x{ratio:.2f}){flag}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=str, nargs="+", default=list(CASES))
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--degrees", type=int, nargs="+", default=DEFAULT_DEGREES)
+    parser.add_argument("--cover-degs", type=int, nargs="+", default=DEFAULT_COVER_DEGS)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--all-sizes", action="store_true")
+    parser.add_argument("--output", type=str, default="bench.json")
+    parser.add_argument("--compare", type=str)
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name in args.cases:
+        _, max_size, base_size = CASES[name]
+        for deg in args.degrees:
+            if base_size is None:
+                grid = [(size, None) for size in args.sizes]
+            else:
+                grid = [
+                    (base_size(deg) * cover_deg, cover_deg)
+                    for cover_deg in args.cover_degs
+                ]
+            for size, cover_deg in grid:
+                if max_size is not None and size > max_size and not args.all_sizes:
+                    continue
+                with concurrent.futures.ProcessPoolExecutor(
+                    1, mp_context=context
+                ) as executor:
+                    result = executor.submit(
+                        run_case, name, size, deg, args.repeats, args.seed, cover_deg
+                    ).result()
+                print(
+                    f"{name:<30} V={size:<8} deg={deg:<3} "
+                    f"{_cover_deg_label(cover_deg)}"
+                    f"median: {result['median_seconds']:.4g}s "
+                    f"peak RSS: {result['peak_rss_mb']:.0f}MB"
+                )
+                results.append(result)
+
+    exponents = scaling_exponents(results)
+    for exponent in exponents:
+        print(
+            f"{exponent['case']:<30} deg={exponent['deg']:<3} "
+            f"time ~ V^{exponent['exponent']:.2f}"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "commit": _commit(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "scipy": scipy.__version__,
+                "results": results,
+                "scaling": exponents,
+            },
+            f,
+            indent=2,
+        )
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
@@ -1,19 +1,40 @@
+from . import datasets
+from . import eigensolvers
+from . import instrumentation
 from . import stats
+from . import streaming
 from . import permutations
+from . import seeding
+from . import spectra
+from .eigensolvers import batched_extremal_eigs
 from .eigenvalues import (
     generate_loop_extremal_eigs,
     generate_matrix_rep_eigs,
     generate_new_extremal_eigs,
 )
 from .covers import (
+    CoverTemplate,
     random_cover,
     random_cover_matrix_rep,
     random_graph,
     random_simple_graph,
 )
-from .matrix_reps import quaternion_matrix_rep
+from .matrix_reps import (
+    GroupRep,
+    cyclic_rep,
+    dihedral_rep,
+    quaternion_matrix_rep,
+    quaternion_rep,
+    symmetric_standard_rep,
+)
+from .operators import GroupRepOperator, PermutationOperator
 
 __all__ = [
+    "batched_extremal_eigs",
+    "CoverTemplate",
+    "datasets",
+    "cyclic_rep",
+    "dihedral_rep",
     "random_cover",
     "random_cover_matrix_rep",
     "random_graph",
@@ -21,7 +42,16 @@ __all__ = [
     "generate_loop_extremal_eigs",
     "generate_matrix_rep_eigs",
     "generate_new_extremal_eigs",
+    "GroupRep",
+    "GroupRepOperator",
+    "instrumentation",
     "permutations",
+    "PermutationOperator",
     "quaternion_matrix_rep",
+    "quaternion_rep",
+    "seeding",
+    "spectra",
     "stats",
+    "streaming",
+    "symmetric_standard_rep",
 ]
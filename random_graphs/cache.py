@@ -0,0 +1,29 @@
+import os
+
+import numpy as np
+
+
+def cache_dir(*subdirs):
+    """Returns the directory for files that random_graphs computes once and reuses,
+    creating it if needed.
+
+    This is $RANDOM_GRAPHS_CACHE if set, and ~/.cache/random_graphs otherwise.
+
+    Args:
+        *subdirs (str): Path components of a subdirectory of the cache.
+    """
+    root = os.environ.get("RANDOM_GRAPHS_CACHE")
+    if root is None:
+        root = os.path.join(os.path.expanduser("~"), ".cache", "random_graphs")
+    path = os.path.join(root, *subdirs)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def save_npz_atomic(path, **arrays):
+    """Saves arrays to the .npz file path, so that concurrent readers either see the
+    complete file or no file at all."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
@@ -1,140 +1,325 @@
 import numpy as np
+from scipy.sparse import bsr_matrix
+from scipy.sparse import coo_matrix
 from scipy.sparse import csr_matrix
-from scipy.sparse import dok_matrix
+from . import instrumentation
+from . import matrix_reps
 from . import permutations
+from .operators import GroupRepOperator
+from .operators import PermutationOperator
+from .seeding import as_generator
 
 
-def random_cover(*, base_graph, cover_deg, permutation_func, identity_shift):
+def base_edges(base_graph):
+    """Returns the edge list of the base graph as COO arrays.
+
+    Args:
+        base_graph (np.array, scipy sparse matrix or (data, (row, col)) tuple): The
+            adjacency matrix of the base graph. This must be a symmetric square matrix.
+
+    Returns:
+        (np.ndarray, np.ndarray, int): The arrays row and col, with row >= col, listing
+            every edge once per multiplicity, and the number of base vertices. An entry
+            of 2m on the diagonal is a vertex with m loops.
+    """
+    base_graph = coo_matrix(base_graph)
+    base_graph.sum_duplicates()
+
+    keep = base_graph.row >= base_graph.col
+    row = base_graph.row[keep]
+    col = base_graph.col[keep]
+    entry = base_graph.data[keep]
+
+    # Each loop contributes 2 to the diagonal entry of the adjacency matrix
+    multiplicity = np.where(row == col, entry / 2, entry).astype(int)
+    return (
+        np.repeat(row, multiplicity),
+        np.repeat(col, multiplicity),
+        base_graph.shape[0],
+    )
+
+
+def random_cover(
+    *,
+    base_graph,
+    cover_deg,
+    permutation_func,
+    identity_shift,
+    as_operator=False,
+    rng=None,
+):
     """Returns a random cover of the base graph, according to the permutation_func given
 
     Args:
-        base_graph (np.array or csr_matrix): The adjacency matrix of the base graph.
-            This must be a symmetric square matrix.
+        base_graph (np.array, scipy sparse matrix or (data, (row, col)) tuple): The
+            adjacency matrix of the base graph. This must be a symmetric square matrix.
         cover_deg (int): The degree of the cover.
         permutation_func (int -> np.array): The function used to generate permutations
-            of {1,...,degree}. Must take in an int, and output an array of that length.
-            E.g. Use np.random.permutation for the general case of the symmetric group.
+            of {1,...,degree}. Must take in an int and the keyword rng, and output an
+            array of that length. E.g. Use permutations.uniform_permutation for the
+            general case of the symmetric group.
         identity_shift (float): Shift the resulting adjacency matrix by x*I for some
             x, where I is the identity matrix. This helps when computing the most
             negative or the most positive eigenvalues of graphs that where these are
             similar in magnitude.
+        as_operator (bool): If True, return a matrix-free PermutationOperator that
+            stores only the permutations instead of a csr_matrix.
+        rng (np.random.Generator or None): The random number generator.
 
     Returns:
         scipy.sparse.csr_matrix: A sparse square matrix of size len(base_graph)*degree.
     """
-    n = base_graph.shape[0] * cover_deg
-    # Originally row_ind and col_ind were numpy arrays, where we appended in each loop
-    # However for taking covers of extremely large graphs that ran slowly on my machine
-    # and it was significantly faster to store everything in lists and append at the end
-    row_ind = []
-    col_ind = []
-
-    # This turns the matrix A into a sparse list of entries
-    # For covers of extremely large graphs, this is the slowest step
-    if not isinstance(base_graph, dok_matrix):
-        base_graph = dok_matrix(base_graph)
-
-    ones = np.ones(cover_deg).astype(int)
-    arange = np.arange(cover_deg)
-    for (i, j), entry in base_graph.items():
-        if i < j:
-            continue
-        elif i == j:
-            entry = int(entry / 2)
-        else:
-            entry = int(entry)
-
-        for k in range(0, entry):
-            random_perm = permutation_func(cover_deg)
+    row, col, num_vertices = base_edges(base_graph)
+    n = num_vertices * cover_deg
+
+    # One permutation per edge, all drawn at once
+    with instrumentation.stage("permutations"):
+        random_perms = permutations.batch_permutations(
+            permutation_func, cover_deg, len(row), rng=rng
+        )
+
+    if as_operator:
+        return PermutationOperator(
+            row=row,
+            col=col,
+            num_vertices=num_vertices,
+            random_perms=random_perms,
+            identity_shift=identity_shift,
+        )
+
+    # Edge (i, j) with permutation p joins cover_deg*i + k to cover_deg*j + p[k]
+    with instrumentation.stage("assembly"):
+        x_coords = (cover_deg * row[:, None] + np.arange(cover_deg)).ravel()
+        y_coords = (cover_deg * col[:, None] + random_perms).ravel()
+        diagonal = np.arange(n)
+
+        row_ind = np.concatenate([x_coords, y_coords, diagonal])
+        col_ind = np.concatenate([y_coords, x_coords, diagonal])
+        data = np.concatenate([np.ones(2 * len(x_coords)), identity_shift * np.ones(n)])
+
+    with instrumentation.stage("coo_to_csr"):
+        return csr_matrix((data, (row_ind, col_ind)), shape=(n, n))
+
+
+class CoverTemplate:
+    """Precomputed sparse structure for sampling many random covers of one base graph.
+
+    Every cover of a fixed base graph has the same number of entries in each row and
+    the same data, only the column indices depend on the permutations. Row
+    cover_deg*i + k holds the entry cover_deg*j + p[k] for each edge (i, j), and row
+    cover_deg*j + k holds cover_deg*i + p^-1[k]. The CSR indptr, data and the
+    identity_shift diagonal are therefore built once, and each sample only writes
+    new column indices into a preallocated buffer.
 
-            x_coords = cover_deg * i * ones + arange
-            y_coords = cover_deg * j * ones + random_perm
-            row_ind.append(x_coords)
-            col_ind.append(y_coords)
-
-            col_ind.append(x_coords)
-            row_ind.append(y_coords)
-
-    row_ind.append(np.arange(n))
-    col_ind.append(np.arange(n))
-
-    row_ind = np.concatenate(row_ind)
-    col_ind = np.concatenate(col_ind)
-
-    data = np.append(
-        np.ones(cover_deg * int(sum(base_graph.values()))), identity_shift * np.ones(n)
-    )  # .astype(int)
+    Args:
+        base_graph (np.array, scipy sparse matrix or (data, (row, col)) tuple): The
+            adjacency matrix of the base graph. This must be a symmetric square matrix.
+        cover_deg (int): The degree of the cover.
+        permutation_func (int -> np.array): The function used to generate permutations
+            of {1,...,degree}, as in random_cover.
+        identity_shift (float): Shift the resulting adjacency matrix by x*I for some
+            x, where I is the identity matrix.
+    """
 
-    return csr_matrix((data, (row_ind, col_ind)), shape=(n, n))
+    def __init__(self, *, base_graph, cover_deg, permutation_func, identity_shift):
+        row, col, num_vertices = base_edges(base_graph)
+        n = num_vertices * cover_deg
+        num_entries = 2 * len(row) * cover_deg
+
+        self.cover_deg = cover_deg
+        self.permutation_func = permutation_func
+        self.num_edges = len(row)
+        self.shape = (n, n)
+
+        index_dtype = np.int32 if num_entries + n < 2**31 else np.int64
+        arange = np.arange(cover_deg)
+
+        # The entries are listed as forward edges, reverse edges, then the diagonal,
+        # and position maps each of them to its place in the CSR arrays.
+        slot_rows = np.concatenate(
+            [
+                (cover_deg * row[:, None] + arange).ravel(),
+                (cover_deg * col[:, None] + arange).ravel(),
+                np.arange(n),
+            ]
+        )
+        order = np.argsort(slot_rows, kind="stable")
+        position = np.empty_like(order)
+        position[order] = np.arange(len(order))
+
+        self.indptr = np.zeros(n + 1, dtype=index_dtype)
+        np.cumsum(np.bincount(slot_rows, minlength=n), out=self.indptr[1:])
+
+        self.indices = np.empty(len(slot_rows), dtype=index_dtype)
+        self.indices[position[num_entries:]] = np.arange(n)
+
+        self.data = np.ones(len(slot_rows))
+        self.data[position[num_entries:]] = identity_shift
+
+        half = num_entries // 2
+        self._forward_position = position[:half].reshape(-1, cover_deg)
+        self._reverse_position = position[half:num_entries].reshape(-1, cover_deg)
+        self._forward_offset = cover_deg * col[:, None]
+        self._reverse_offset = cover_deg * row[:, None]
+        self._edge_index = np.arange(len(row))[:, None]
+        self._arange = arange
+        self._perm_inv = np.empty((len(row), cover_deg), dtype=index_dtype)
+
+    def sample(self, *, copy=True, rng=None):
+        """Returns a new random cover of the base graph.
+
+        Args:
+            copy (bool): If False, the returned matrix shares its indices with the
+                template and is overwritten by the next call to sample. This avoids
+                all per-sample allocation when each cover is discarded before the
+                next is drawn.
+            rng (np.random.Generator or None): The random number generator.
+
+        Returns:
+            scipy.sparse.csr_matrix: A sparse square matrix of size
+                len(base_graph)*cover_deg.
+        """
+        with instrumentation.stage("permutations"):
+            random_perms = permutations.batch_permutations(
+                self.permutation_func, self.cover_deg, self.num_edges, rng=rng
+            )
+
+        with instrumentation.stage("assembly"):
+            self._perm_inv[self._edge_index, random_perms] = self._arange
+            self.indices[self._forward_position] = self._forward_offset + random_perms
+            self.indices[self._reverse_position] = self._reverse_offset + self._perm_inv
+
+        return csr_matrix(
+            (self.data, self.indices, self.indptr), shape=self.shape, copy=copy
+        )
+
+
+def cyclic_character_blocks(*, row, col, num_vertices, cover_deg, shifts):
+    """Returns the non-trivial character blocks of a cyclic cover of the base graph.
+
+    A cover whose permutations are cyclic shifts, as drawn by
+    permutations.abelian_cycle, is a Z_n voltage graph with n = cover_deg: the edge
+    (i, j) with shift s joins cover_deg*i + k to cover_deg*j + (k + s) % n. On the
+    vectors u_i * w^(m*k) with w = exp(2*pi*i/n) the cover acts as the V x V
+    Hermitian matrix A_m with A_m[i, j] += w^(m*s) and A_m[j, i] += w^(-m*s) for
+    each edge, so the spectrum of the cover is the union of the spectra of A_0 to
+    A_(n-1). A_0 is the base graph, and A_(n-m) is the complex conjugate of A_m with
+    the same spectrum, so the new eigenvalues are those of A_1 to A_(n//2).
 
+    Args:
+        row (np.ndarray): The first endpoint of each base edge, as in base_edges.
+        col (np.ndarray): The second endpoint of each base edge.
+        num_vertices (int): The number of vertices of the base graph.
+        cover_deg (int): The degree of the cover.
+        shifts (np.ndarray): The shift of each base edge.
 
-def random_cover_matrix_rep(*, base_graph, matrix_func, identity_shift):
-    """Returns a random cover of the base graph, according to the permutation_func given
+    Returns:
+        list of scipy.sparse.csr_matrix: The complex Hermitian blocks A_1 to
+            A_(cover_deg//2).
+    """
+    rows = np.concatenate([row, col])
+    cols = np.concatenate([col, row])
+    blocks = []
+    for m in range(1, cover_deg // 2 + 1):
+        phases = np.exp(2j * np.pi * m * shifts / cover_deg)
+        data = np.concatenate([phases, phases.conj()])
+        blocks.append(
+            csr_matrix((data, (rows, cols)), shape=(num_vertices, num_vertices))
+        )
+    return blocks
+
+
+def random_cover_matrix_rep(
+    *, base_graph, matrix_func, identity_shift, as_operator=False, rng=None
+):
+    """Returns a random cover of the base graph, where each edge is replaced by a
+    random matrix drawn from matrix_func.
+
+    For an edge (i, j) with i > j and random matrix M, block (j, i) of the output is
+    M and block (i, j) is M^T. The blocks are assembled directly into a bsr_matrix
+    whose blocksize is the size of the matrices, so its matvecs run block by block.
 
     Args:
         base_graph (np.array or csr_matrix): The adjacency matrix of the base graph.
             This must be a symmetric square matrix. Must be simple with no self loops.
-        matrix_func (None -> np.ndarray): The function returns a random matrix of a
-            specific pre-determined size.
+        matrix_func (GroupRep or np.random.Generator -> np.ndarray): The function
+            returns a random matrix of a specific pre-determined size, drawn with the
+            keyword rng. Group representations, such as
+            matrix_reps.quaternion_matrix_rep, are sampled as element indices into
+            their table.
         identity_shift (float): Shift the resulting adjacency matrix by x*I for some
             x, where I is the identity matrix. This helps when computing the most
             negative or the most positive eigenvalues of graphs that where these are
             similar in magnitude.
+        as_operator (bool): If True, return a matrix-free GroupRepOperator that
+            stores one group element index per edge. matrix_func must then be a
+            group representation.
+        rng (np.random.Generator or None): The random number generator.
 
     Returns:
-        scipy.sparse.csr_matrix: Size matrix_size*len(base_graph)
+        scipy.sparse.bsr_matrix: Size matrix_size*len(base_graph)
     """
 
     if np.max(base_graph) > 1:
         raise ValueError("Base Graph must be simple.")
 
-    matrix_size = matrix_func().shape[0]
-    n = base_graph.shape[0] * matrix_size
-
-    row_ind = []
-    col_ind = []
-    data = []
-
-    # This turns the matrix A into a sparse list of entries
-    # For covers of extremely large graphs, this is the slowest step
-    if not isinstance(base_graph, dok_matrix):
-        base_graph = dok_matrix(base_graph)
-
-    ones = np.ones(matrix_size).astype(int)
-    arange = np.arange(matrix_size)
-    for (i, j), entry in base_graph.items():
-        if i <= j:
-            continue
+    rng = as_generator(rng)
+    row, col, num_vertices = base_edges(base_graph)
+    group = matrix_reps.as_group_rep(matrix_func)
+
+    with instrumentation.stage("matrix_reps"):
+        if group is not None:
+            elements = group.sample_indices(len(row), rng=rng)
+            if not as_operator:
+                # The operator only keeps the element indices
+                random_matrices = group.table[elements]
+        elif as_operator:
+            raise ValueError("as_operator needs matrix_func to be a group rep")
         else:
-            random_matrix = matrix_func()
-            data.append(random_matrix.flatten())
-            data.append(random_matrix.flatten())
-
-            for k in range(0, matrix_size):
-                x_coords = matrix_size * i * ones + arange
-                y_coords = matrix_size * j * ones + k * ones
-                row_ind.append(x_coords)
-                col_ind.append(y_coords)
-
-            for k in range(0, matrix_size):
-                x_coords = matrix_size * i * ones + arange
-                y_coords = matrix_size * j * ones + k * ones
-                row_ind.append(y_coords)
-                col_ind.append(x_coords)
-
-    # Add a multiple of the identity
-    row_ind.append(np.arange(n))
-    col_ind.append(np.arange(n))
-    data.append(identity_shift * np.ones(n))
-
-    row_ind = np.concatenate(row_ind)
-    col_ind = np.concatenate(col_ind)
-    data = np.concatenate(data)
-
-    return csr_matrix((data, (row_ind, col_ind)), shape=(n, n))
+            random_matrices = matrix_reps.batch_matrix_reps(
+                matrix_func, len(row), rng=rng
+            )
+
+    if as_operator:
+        return GroupRepOperator(
+            row=row,
+            col=col,
+            num_vertices=num_vertices,
+            group=group,
+            elements=elements,
+            identity_shift=identity_shift,
+        )
+
+    matrix_size = random_matrices.shape[1]
+    n = num_vertices * matrix_size
+
+    with instrumentation.stage("assembly"):
+        # Blocks are listed as (j, i) edges, (i, j) edges, then the diagonal, and
+        # sorted into BSR order with a single gather
+        vertices = np.arange(num_vertices)
+        block_rows = np.concatenate([col, row, vertices])
+        block_cols = np.concatenate([row, col, vertices])
+        blocks = np.concatenate(
+            [
+                random_matrices,
+                random_matrices.transpose(0, 2, 1),
+                np.broadcast_to(
+                    identity_shift * np.eye(matrix_size),
+                    (num_vertices, matrix_size, matrix_size),
+                ),
+            ]
+        )
+
+        order = np.lexsort((block_cols, block_rows))
+        indptr = np.zeros(num_vertices + 1, dtype=np.int32)
+        np.cumsum(np.bincount(block_rows, minlength=num_vertices), out=indptr[1:])
+
+    return bsr_matrix(
+        (blocks[order], block_cols[order].astype(np.int32), indptr), shape=(n, n)
+    )
 
 
-def random_graph(*, deg, size, identity_shift=0):
+def random_graph(*, deg, size, identity_shift=0, as_operator=False, rng=None):
     """Generates a random graph from the loop. Graph will not necessarily be simple,
     but will have no self-loops.
 
@@ -146,6 +331,9 @@ def random_graph(*, deg, size, identity_shift=0):
             real number x, where I is the identity matrix. This helps when computing the
             most negative or positive eigenvalues of graphs that where these are
             similar in magnitude.
+        as_operator (bool): If True, return a matrix-free PermutationOperator that
+            stores only the deg/2 permutations instead of a csr_matrix.
+        rng (np.random.Generator or None): The random number generator.
 
     Returns:
         scipy.sparse.csr_matrix: A sparse square adjacency matrix of size size
@@ -160,14 +348,16 @@ def random_graph(*, deg, size, identity_shift=0):
         # We use derangements to remove self loops
         permutation_func=permutations.derangement,
         identity_shift=identity_shift,
+        as_operator=as_operator,
+        rng=rng,
     )
     return output_graph
 
 
-def random_simple_graph(*, deg, size, identity_shift=0):
+def random_simple_graph(*, deg, size, identity_shift=0, as_operator=False, rng=None):
     """Generates a random simple graph as a cover of the loop. The permutations used
     are generated to avoid overlap with any of the previously generated permutations.
-    This occurs in the permutation function derangement_avoiding_others
+    This occurs in the permutation function simple_permutations
 
     Args:
         deg (int): The degree of the graph. Must be even since we are taking covers
@@ -177,6 +367,9 @@ def random_simple_graph(*, deg, size, identity_shift=0):
             real number x, where I is the identity matrix. This helps when computing the
             most negative or positive eigenvalues of graphs that where these are
             similar in magnitude.
+        as_operator (bool): If True, return a matrix-free PermutationOperator that
+            stores only the deg/2 permutations instead of a csr_matrix.
+        rng (np.random.Generator or None): The random number generator.
 
     Returns:
         scipy.sparse.csr_matrix: A sparse square adjacency matrix of size size
@@ -184,32 +377,36 @@ def random_simple_graph(*, deg, size, identity_shift=0):
     if deg % 2 != 0:
         raise ValueError("2 must divide deg since we are taking covers of the loop")
 
-    row_ind = []
-    col_ind = []
+    with instrumentation.stage("permutations"):
+        random_perms = permutations.simple_permutations(size, int(deg / 2), rng=rng)
+
+    if as_operator:
+        loop = np.zeros(len(random_perms), dtype=int)
+        return PermutationOperator(
+            row=loop,
+            col=loop,
+            num_vertices=1,
+            random_perms=random_perms,
+            identity_shift=identity_shift,
+        )
+
+    # One row of entries per direction of each permutation, k -> p[k] then
+    # p[k] -> k, and a last row for the diagonal
+    num_perms = len(random_perms)
     arange = np.arange(size)
-
-    random_perms = []
-    for k in range(0, int(deg / 2)):
-        random_perm = permutations.derangement_avoiding_others(size, random_perms)
-        random_perms.append(random_perm)
-
-    for random_perm in random_perms:
-        x_coords = arange
-        y_coords = random_perm
-        row_ind.append(x_coords)
-        col_ind.append(y_coords)
-
-        col_ind.append(x_coords)
-        row_ind.append(y_coords)
-
-    row_ind.append(np.arange(size))
-    col_ind.append(np.arange(size))
-
-    row_ind = np.concatenate(row_ind)
-    col_ind = np.concatenate(col_ind)
-
-    data = np.append(
-        np.ones(size * deg), identity_shift * np.ones(size)
-    )  # .astype(int)
-
-    return csr_matrix((data, (row_ind, col_ind)), shape=(size, size))
+    row_ind = np.empty((2 * num_perms + 1, size), dtype=random_perms.dtype)
+    col_ind = np.empty_like(row_ind)
+    row_ind[0:-1:2] = arange
+    col_ind[0:-1:2] = random_perms
+    row_ind[1:-1:2] = random_perms
+    col_ind[1:-1:2] = arange
+    row_ind[-1] = arange
+    col_ind[-1] = arange
+
+    data = np.ones(row_ind.shape)
+    data[-1] = identity_shift
+
+    with instrumentation.stage("coo_to_csr"):
+        return csr_matrix(
+            (data.ravel(), (row_ind.ravel(), col_ind.ravel())), shape=(size, size)
+        )
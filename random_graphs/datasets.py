@@ -0,0 +1,238 @@
+import functools
+import json
+import os
+import re
+import subprocess
+
+import numpy as np
+
+# The naming schemes of the result files, old and new. Each maps to the name of
+# the experiment and the parameters encoded in the name, in order. Parameters are
+# ints, except the name of the base graph file of base_cover.
+_FILENAME_PATTERNS = [
+    (r"simple_deg(\d+)_V(\d+)_N(\d+)", "simple", ("deg", "size", "number")),
+    (
+        r"loop_cover_?(?:deg)?(\d+)_V(\d+)_N(\d+)",
+        "loop_cover",
+        ("deg", "size", "number"),
+    ),
+    (
+        r"abelian_?cover_V(\d+)x(\d+)_N(\d+)x(\d+)_bdeg(\d+)",
+        "abelian_cover",
+        ("size", "cover_deg", "number", "number_covers", "deg"),
+    ),
+    (r"quaternion_deg(\d+)_V(\d+)x4_N(\d+)", "quaternion", ("deg", "size", "number")),
+    (
+        r"complete_cover_V(\d+)x(\d+)_N(\d+)",
+        "complete_cover",
+        ("cover_deg", "base_size", "number"),
+    ),
+    (
+        r"k5_minus_edge_cover_V(\d+)x5_N(\d+)",
+        "k5_minus_edge_cover",
+        ("cover_deg", "number"),
+    ),
+    (
+        r"base_cover_([\w-]+?)_V(\d+)x(\d+)_N(\d+)",
+        "base_cover",
+        ("base", "size", "cover_deg", "number"),
+    ),
+]
+
+
+def parse_filename(path):
+    """Returns the experiment and parameters encoded in the name of a result file.
+
+    Both abeliancover_... as written by scripts/cyclic_covers.py and
+    abelian_cover_... as in older files are recognized. Runs in the single or mixed
+    precision tiers end in _single or _mixed, which is returned as the parameter
+    precision.
+
+    Returns:
+        (str, dict): The experiment name and its parameters, or (None, {}) if the
+            name does not follow a known scheme.
+    """
+    name = os.path.basename(path)
+    if name.endswith(".npy"):
+        name = name[:-4]
+    extra = {}
+    precision = re.fullmatch(r"(.*)_(single|mixed)", name)
+    if precision is not None:
+        name, extra["precision"] = precision.groups()
+    for pattern, experiment, keys in _FILENAME_PATTERNS:
+        match = re.fullmatch(pattern, name)
+        if match is not None:
+            values = [int(x) if x.isdigit() else x for x in match.groups()]
+            return experiment, {**dict(zip(keys, values)), **extra}
+    return None, {}
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """Returns the git commit of the random_graphs source, with a -dirty suffix if
+    it has uncommitted changes, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty", "--abbrev=40"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata_path(path):
+    """Returns the json sidecar file of the result file path."""
+    return path[:-4] + ".json"
+
+
+def write_metadata(path, metadata):
+    """Saves the metadata of the result file path to its json sidecar."""
+    tmp_path = metadata_path(path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f, indent=1)
+    os.replace(tmp_path, metadata_path(path))
+
+
+def read_metadata(path):
+    """Returns the metadata in the json sidecar of the result file path, or an empty
+    dict for files without one."""
+    if not os.path.exists(metadata_path(path)):
+        return {}
+    with open(metadata_path(path)) as f:
+        return json.load(f)
+
+
+class Dataset:
+    """One result file, described by its name and json sidecar.
+
+    The results are only read when needed, through a memory map, so a slice of a
+    large file only reads that slice from disk.
+
+    Args:
+        path (str): The .npy file of the results.
+        experiment (str or None): The experiment name, parsed from the filename if
+            None.
+        params (dict or None): The parameters of the experiment. If None, those
+            parsed from the filename updated with the params of the sidecar.
+        metadata (dict or None): The sidecar contents. Read from disk if None.
+    """
+
+    def __init__(self, path, experiment=None, params=None, metadata=None):
+        self.path = path
+        self.metadata = read_metadata(path) if metadata is None else metadata
+        parsed_experiment, parsed_params = parse_filename(path)
+        self.experiment = parsed_experiment if experiment is None else experiment
+        if params is None:
+            params = {**parsed_params, **self.metadata.get("params", {})}
+        self.params = params
+        self._eigs = None
+
+    def __repr__(self):
+        return f"Dataset({self.path!r}, {self.experiment!r}, {self.params})"
+
+    @property
+    def eigs(self):
+        """The results, memory-mapped on first access."""
+        if self._eigs is None:
+            self._eigs = np.load(self.path, mmap_mode="r")
+        return self._eigs
+
+    def matches(self, experiment=None, **params):
+        """Returns whether the dataset is of the given experiment and has all the
+        given parameter values."""
+        if experiment is not None and experiment != self.experiment:
+            return False
+        return all(self.params.get(key) == value for key, value in params.items())
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "experiment": self.experiment,
+            "params": self.params,
+            "metadata": self.metadata,
+        }
+
+
+class Catalog:
+    """An index of every result file under a directory, e.g. data/.
+
+    The index is saved to catalog.json in the directory, so later catalogs only
+    read the sidecars of files that are new or changed since it was built.
+
+    Args:
+        root (str): The directory to index.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, "catalog.json")
+        self.datasets = self._scan()
+
+    def _scan(self):
+        index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+
+        datasets = []
+        new_index = {}
+        for directory, dirnames, filenames in os.walk(self.root):
+            # The chunks of interrupted or sharded runs are not datasets
+            dirnames[:] = sorted(d for d in dirnames if not d.endswith(".chunks"))
+            for filename in sorted(filenames):
+                # Skip the partial files of runs still merging their chunks
+                if not filename.endswith(".npy") or filename.endswith(".tmp.npy"):
+                    continue
+                path = os.path.join(directory, filename)
+                relative = os.path.relpath(path, self.root)
+                mtimes = [os.path.getmtime(path)]
+                if os.path.exists(metadata_path(path)):
+                    mtimes.append(os.path.getmtime(metadata_path(path)))
+
+                entry = index.get(relative)
+                if entry is not None and entry["mtime"] == max(mtimes):
+                    dataset = Dataset(
+                        path, entry["experiment"], entry["params"], entry["metadata"]
+                    )
+                else:
+                    dataset = Dataset(path)
+                datasets.append(dataset)
+
+                # The per-chunk timings stay in the sidecars to keep the index small
+                entry = {**dataset.to_dict(), "mtime": max(mtimes)}
+                entry["metadata"] = {
+                    key: value
+                    for key, value in dataset.metadata.items()
+                    if key != "chunks"
+                }
+                del entry["path"]
+                new_index[relative] = entry
+
+        if new_index != index:
+            try:
+                tmp_path = self.index_path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(new_index, f, indent=1)
+                os.replace(tmp_path, self.index_path)
+            except OSError:
+                # A read-only copy of the data is still indexed, just not saved
+                pass
+        return datasets
+
+    def __iter__(self):
+        return iter(self.datasets)
+
+    def __len__(self):
+        return len(self.datasets)
+
+    def query(self, experiment=None, **params):
+        """Returns the datasets of the given experiment with all the given parameter
+        values, e.g. catalog.query("simple", deg=4, size=100000)."""
+        return [
+            dataset
+            for dataset in self.datasets
+            if dataset.matches(experiment, **params)
+        ]
@@ -0,0 +1,552 @@
+import functools
+import json
+import os
+import platform
+import time
+import warnings
+
+import numpy as np
+import scipy
+from scipy.linalg import eigh_tridiagonal
+from scipy.sparse import block_diag, csr_matrix, issparse
+from scipy.sparse.linalg import LinearOperator, eigsh, lobpcg
+from . import instrumentation
+from .cache import cache_dir
+from .seeding import as_generator
+
+# The sizes and degree of the random regular graphs the solvers are timed on
+_CALIBRATION_SIZES = (32, 64, 128, 256, 512, 1024, 2048)
+_CALIBRATION_DEGREE = 4
+# The number of eigenvalues the solvers are timed on
+_CALIBRATION_K = 2
+
+# lobpcg is unreliable unless the matrix is several times larger than its block of
+# k vectors
+_LOBPCG_MIN_SIZE_PER_EIG = 8
+
+
+def project_fibers(X, fiber_size):
+    """Removes from each row of X its projection onto the vectors that are constant
+    on consecutive blocks (fibers) of fiber_size coordinates.
+
+    For a d-regular graph with fiber_size equal to its size, this projects out the
+    constant eigenvector of the trivial eigenvalue d.
+    """
+    if fiber_size is None:
+        return X
+    fibers = X.reshape(X.shape[0], -1, fiber_size)
+    return (fibers - fibers.mean(axis=2, keepdims=True)).reshape(X.shape)
+
+
+def fiber_deflated_operator(A, fiber_size):
+    """Returns A restricted to the vectors whose sum over every fiber of fiber_size
+    consecutive coordinates is zero, as a LinearOperator.
+
+    For a cover of degree fiber_size, the vectors constant on fibers are exactly the
+    pull-backs of functions on the base graph. They span an invariant subspace that
+    holds every base eigenvalue, so the deflated operator only has the new
+    eigenvalues of the cover, plus zeros on the projected out subspace. For covers
+    of the loop this projects out the constant vector.
+    """
+
+    def matvec(x):
+        x = project_fibers(np.ravel(x)[None, :], fiber_size)
+        return project_fibers((A @ x[0])[None, :], fiber_size)[0]
+
+    return LinearOperator(A.shape, matvec=matvec, rmatvec=matvec, dtype=A.dtype)
+
+
+def _extremal_ritz_pair(alphas, betas, which):
+    """Returns the extremal Ritz value of a Lanczos tridiagonal matrix together with
+    the estimate beta_m*|s_m| of its residual norm."""
+    m = len(alphas)
+    candidates = []
+    if which in ("LA", "LM"):
+        candidates.append(m - 1)
+    if which in ("SA", "LM"):
+        candidates.append(0)
+
+    best = None
+    for index in candidates:
+        theta, s = eigh_tridiagonal(
+            alphas, betas[:-1], select="i", select_range=(index, index)
+        )
+        if best is None or abs(theta[0]) > abs(best[0]):
+            best = (theta[0], betas[-1] * abs(s[-1, 0]))
+    return best
+
+
+def batched_extremal_eigs(
+    matrices,
+    *,
+    which="LA",
+    fiber_size=None,
+    tol=1e-10,
+    check_every=10,
+    maxiter=None,
+    v0=None,
+    rng=None,
+):
+    """Returns the extremal eigenvalue of each of a stack of symmetric matrices of
+    the same size, computed together in one batched Lanczos iteration.
+
+    Every matrix runs its own Lanczos recurrence, but the matvecs of all of them go
+    through a single block diagonal sparse product and the recurrences are updated
+    as (batch, n) arrays. Only the last two Lanczos vectors are kept, since the
+    extremal Ritz value converges without reorthogonalization. Each matrix is
+    dropped from the batch as soon as its residual estimate passes tol. This
+    avoids the per-call overhead of running eigsh once per graph.
+
+    Args:
+        matrices (list of scipy sparse matrices): Symmetric matrices of equal size.
+        which (str): One of 'LA', 'SA' or 'LM', for the largest algebraic, smallest
+            algebraic, or largest magnitude eigenvalue, as in eigsh.
+        fiber_size (int or None): If given, the iteration is restricted to the vectors
+            whose sum over every block of fiber_size consecutive coordinates is zero.
+            Use fiber_size=size to skip the trivial eigenvalue of regular graphs.
+        tol (float): Convergence tolerance on the residual norm, relative to the
+            magnitude of the eigenvalue.
+        check_every (int): Number of Lanczos steps between convergence checks.
+        maxiter (int or None): Maximum number of Lanczos steps. Defaults to 10*n.
+        v0 (np.ndarray or None): Starting vectors of shape (len(matrices), n). If None
+            they are drawn from rng.
+        rng (np.random.Generator or None): The random number generator.
+
+    Returns:
+        np.ndarray: The extremal eigenvalue of each matrix.
+    """
+    if which not in ("LA", "SA", "LM"):
+        raise ValueError(f"which '{which}' is invalid. Must be one of 'LA', 'SA', 'LM'")
+
+    n = matrices[0].shape[0]
+    if maxiter is None:
+        maxiter = 10 * n
+
+    eigs = np.full(len(matrices), np.nan)
+    active = np.arange(len(matrices))
+    A = block_diag(matrices, format="csr")
+
+    if v0 is None:
+        v0 = as_generator(rng).standard_normal((len(matrices), n))
+    q = project_fibers(np.array(v0, dtype=float), fiber_size)
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    q_prev = np.zeros_like(q)
+    beta = np.zeros(len(matrices))
+    alphas = []
+    betas = []
+
+    for step in range(1, maxiter + 1):
+        w = (A @ q.ravel()).reshape(q.shape)
+        alpha = np.einsum("bn,bn->b", q, w)
+        w -= alpha[:, None] * q + beta[:, None] * q_prev
+        w = project_fibers(w, fiber_size)
+        beta = np.linalg.norm(w, axis=1)
+
+        alphas.append(alpha)
+        betas.append(beta)
+        q_prev = q
+        with np.errstate(invalid="ignore", divide="ignore"):
+            q = w / beta[:, None]
+
+        # A zero beta means the Krylov space is exhausted and the Ritz values are
+        # exact, so that matrix must be checked before the next step.
+        breakdown = beta <= 1e-14 * np.abs(alpha)
+        if step % check_every != 0 and not breakdown.any():
+            continue
+
+        all_alphas = np.array(alphas)
+        all_betas = np.array(betas)
+        converged = np.zeros(len(active), dtype=bool)
+        for b in range(len(active)):
+            theta, residual = _extremal_ritz_pair(
+                all_alphas[:, b], all_betas[:, b], which
+            )
+            if residual <= tol * max(abs(theta), 1) or breakdown[b]:
+                eigs[active[b]] = theta
+                converged[b] = True
+
+        if converged.all():
+            return eigs
+        if converged.any():
+            keep = ~converged
+            active = active[keep]
+            A = block_diag([matrices[i] for i in active], format="csr")
+            q, q_prev, beta = q[keep], q_prev[keep], beta[keep]
+            alphas = [x[keep] for x in alphas]
+            betas = [x[keep] for x in betas]
+
+    raise RuntimeError(
+        f"batched_extremal_eigs did not converge in {maxiter} Lanczos steps"
+    )
+
+
+def _calibration_matrix(n, rng):
+    # The adjacency matrix of a random 4-regular multigraph, a union of 2 random
+    # permutations and their inverses
+    rows = np.tile(np.arange(n), _CALIBRATION_DEGREE // 2)
+    cols = np.concatenate([rng.permutation(n) for _ in range(_CALIBRATION_DEGREE // 2)])
+    A = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    return A + A.T
+
+
+def _time(func, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        try:
+            func()
+        except RuntimeError:
+            return np.inf
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def calibrate_solvers():
+    """Times the dense, eigsh and lobpcg solvers on random regular graphs of
+    increasing size, and returns the thresholds choose_solver uses.
+
+    Returns:
+        dict: 'dense_max_size', the largest size at which the dense eigvalsh is
+            faster than eigsh, 'lobpcg_min_size', the smallest size at which lobpcg
+            is faster than eigsh (or None), and the versions they were timed with.
+    """
+    rng = np.random.default_rng(0)
+    dense_max_size = _CALIBRATION_SIZES[0]
+    lobpcg_min_size = None
+    for n in _CALIBRATION_SIZES:
+        A = _calibration_matrix(n, rng)
+        v0 = rng.uniform(-1, 1, size=n)
+        eigsh_time = _time(lambda: _eigsh(A, k=_CALIBRATION_K, which="LA", v0=v0))
+        dense_time = _time(lambda: _dense(A, k=_CALIBRATION_K, which="LA"))
+        if dense_time <= eigsh_time:
+            dense_max_size = n
+        if lobpcg_min_size is None and n >= _LOBPCG_MIN_SIZE_PER_EIG * _CALIBRATION_K:
+            lobpcg_time = _time(lambda: _lobpcg(A, k=_CALIBRATION_K, which="LA", v0=v0))
+            if lobpcg_time < eigsh_time:
+                lobpcg_min_size = n
+        if dense_time > 4 * eigsh_time and lobpcg_min_size is not None:
+            break
+    return {
+        "dense_max_size": dense_max_size,
+        "lobpcg_min_size": lobpcg_min_size,
+        "degree": _CALIBRATION_DEGREE,
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def solver_thresholds():
+    """Returns the calibrate_solvers thresholds of this host.
+
+    They are measured once and saved under cache_dir("solvers"), keyed by host name
+    and CPU count, and measured again when numpy or scipy change. Run it in the
+    parent process before starting workers, so they only read the saved file.
+    """
+    path = os.path.join(cache_dir("solvers"), "thresholds.json")
+    host = f"{platform.node()}-{os.cpu_count()}"
+    saved = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+
+    thresholds = saved.get(host)
+    versions = {"numpy": np.__version__, "scipy": scipy.__version__}
+    if thresholds is None or any(thresholds[k] != v for k, v in versions.items()):
+        thresholds = calibrate_solvers()
+        saved[host] = thresholds
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(saved, f, indent=1)
+        os.replace(tmp_path, path)
+    return thresholds
+
+
+def choose_solver(*, n, nnz=None, k=1, which="LA", matrix_free=False):
+    """Returns the fastest solver for k extremal eigenvalues of a symmetric n x n
+    matrix with nnz stored entries, from the thresholds of solver_thresholds.
+
+    The calibrated dense threshold is for degree 4 graphs and k = 2. The cost of
+    eigsh grows with nnz and k while the dense cost only depends on n, so the
+    threshold is scaled by sqrt(average degree / 4 * k / 2).
+
+    Args:
+        n (int): The size of the matrix.
+        nnz (int or None): The number of stored entries, or None for operators.
+        k (int): The number of eigenvalues needed.
+        which (str): One of 'LA', 'SA' or 'LM', as in eigsh.
+        matrix_free (bool): Whether the matrix is only available through matvecs.
+
+    Returns:
+        str: One of 'dense', 'eigsh' or 'lobpcg'.
+    """
+    if k >= n - 1:
+        # eigsh needs k < n - 1
+        return "dense"
+    thresholds = solver_thresholds()
+    average_degree = nnz / n if nnz is not None else thresholds["degree"]
+    scale = np.sqrt(max(average_degree / thresholds["degree"], 1) * max(k, 2) / 2)
+    if n <= thresholds["dense_max_size"] * scale:
+        # Materializing an operator costs n matvecs, still cheap at these sizes
+        return "dense"
+    lobpcg_min_size = thresholds["lobpcg_min_size"]
+    if (
+        lobpcg_min_size is not None
+        and not matrix_free
+        and which != "LM"
+        and n >= max(lobpcg_min_size, _LOBPCG_MIN_SIZE_PER_EIG * k)
+    ):
+        return "lobpcg"
+    return "eigsh"
+
+
+# The precision tiers of extremal_eigs
+PRECISIONS = ("double", "single", "mixed")
+
+# The relative residual tolerance of the float32 eigsh solves of the single and
+# mixed precision tiers, a few times the float32 machine epsilon
+_SINGLE_TOL = 1e-5
+
+
+def single_dtype(dtype):
+    """Returns float32, or complex64 for complex dtypes."""
+    return np.complex64 if np.dtype(dtype).kind == "c" else np.float32
+
+
+def _select_indices(eigs, k, which):
+    """Returns the indices of the k eigenvalues of the ascending eigs that eigsh
+    would return."""
+    if which == "LA":
+        return np.arange(len(eigs) - k, len(eigs))
+    if which == "SA":
+        return np.arange(k)
+    # Eigenvalues of equal magnitude up to rounding, like +-sqrt(3) in a symmetric
+    # spectrum, are ordered by value so that the positive one is kept
+    order = np.lexsort((eigs, np.round(np.abs(eigs), 10)))
+    return np.sort(order[len(eigs) - k :])
+
+
+def _select(eigs, k, which):
+    """Returns the k eigenvalues of the ascending eigs that eigsh would return."""
+    return eigs[_select_indices(eigs, k, which)]
+
+
+def _dense(A, *, k, which, dtype=None):
+    if issparse(A):
+        A = A.toarray()
+    elif isinstance(A, LinearOperator):
+        A = A @ np.eye(A.shape[0], dtype=A.dtype)
+    A = np.asarray(A)
+    if dtype is not None:
+        A = A.astype(dtype)
+    return _select(np.linalg.eigvalsh(A), k, which)
+
+
+def _eigsh(A, *, k, which, v0=None):
+    return eigsh(A, k=k, which=which, v0=v0, return_eigenvectors=False)
+
+
+def _lobpcg(A, *, k, which, v0=None):
+    """Returns the eigenvalues in ascending order and their residual norms, which
+    bound their distance to the spectrum of A, as lobpcg only converges to tol."""
+    rng = np.random.default_rng(0)
+    # Complex for the character blocks of cyclic covers, so v0 is kept whole
+    X = rng.uniform(-1, 1, size=(A.shape[0], k)).astype(np.result_type(A.dtype, float))
+    if v0 is not None:
+        X[:, 0] = v0
+    with warnings.catch_warnings():
+        # lobpcg warns instead of raising when it does not converge
+        warnings.simplefilter("error")
+        try:
+            eigs, vectors = lobpcg(
+                A,
+                X,
+                largest=which == "LA",
+                tol=1e-8,
+                maxiter=200,
+                retLambdaHistory=False,
+            )[:2]
+        except (UserWarning, np.linalg.LinAlgError) as error:
+            raise RuntimeError("lobpcg did not converge") from error
+    order = np.argsort(eigs)
+    eigs, vectors = eigs[order], vectors[:, order]
+    return eigs, _residual_norms(A, vectors, eigs)
+
+
+def _as_single(A):
+    """Returns a float32 (or complex64) copy of A, or A itself for operators that
+    cannot be converted."""
+    if issparse(A):
+        return A.astype(single_dtype(A.dtype))
+    if hasattr(A, "astype"):
+        return A.astype(single_dtype(A.dtype))
+    return A
+
+
+def _residual_norms(A, vectors, eigs):
+    return np.linalg.norm(A @ vectors - vectors * eigs, axis=0)
+
+
+def refine_eigenpairs(A, vectors, eigs, *, which, steps=4, tol=1e-12, max_rounds=5):
+    """Refines approximate extremal eigenpairs of A in the precision of A.
+
+    Each round is a Rayleigh-Ritz step on the block Krylov space spanned by the
+    vectors and their first steps images under A. Refining the pairs together keeps
+    close eigenvalues apart.
+
+    The residual norm r of a Ritz pair bounds its distance to the spectrum, but at
+    the spectral edge of large graphs the gap to the next eigenvalue is tiny, so r
+    stalls long after the eigenvalue has converged. The error of each eigenvalue is
+    instead estimated as min(r, r**2 / gap), as in the Kato-Temple bound, with the
+    gap to the nearest other Ritz value standing in for the unknown gap in the
+    spectrum, and at least as much as the eigenvalue moved in the last round. The
+    rounds stop once the estimates are below tol relative to the eigenvalues, or
+    when a round moves the eigenvalues by more than half as much as the previous
+    one, as further rounds would barely improve them.
+
+    Args:
+        A (scipy sparse matrix or LinearOperator): The matrix.
+        vectors (np.ndarray): The approximate eigenvectors, as columns.
+        eigs (np.ndarray): The approximate eigenvalues.
+        which (str): One of 'LA', 'SA' or 'LM', which extremal eigenvalues they are.
+        steps (int): The number of Krylov steps per round.
+        tol (float): The error estimate, relative to the eigenvalue, to stop at.
+        max_rounds (int): The maximum number of rounds.
+
+    Returns:
+        (np.ndarray, np.ndarray): The refined eigenvalues in ascending order and
+            the estimates of their errors.
+    """
+    k = len(eigs)
+    vectors = np.asarray(vectors, dtype=A.dtype)
+    eigs = np.sort(eigs)
+    previous_change = None
+    for _ in range(max_rounds):
+        basis = [vectors]
+        for _ in range(steps):
+            basis.append(A @ basis[-1])
+        Q = np.linalg.qr(np.hstack(basis))[0]
+        H = Q.conj().T @ (A @ Q)
+        ritz_values, ritz_vectors = np.linalg.eigh((H + H.conj().T) / 2)
+
+        index = np.sort(_select_indices(ritz_values, k, which))
+        change = np.abs(ritz_values[index] - eigs)
+        eigs = ritz_values[index]
+        vectors = Q @ ritz_vectors[:, index]
+        residuals = _residual_norms(A, vectors, eigs)
+
+        # The distance of each Ritz value to the nearest other one
+        distances = np.abs(ritz_values[index, None] - ritz_values[None, :])
+        distances[np.arange(k), index] = np.inf
+        gaps = np.min(distances, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            kato_temple = np.where(
+                np.isfinite(gaps) & (gaps > 0), residuals**2 / gaps, residuals
+            )
+        errors = np.maximum(np.minimum(residuals, kato_temple), change)
+
+        if np.all(errors <= tol * np.maximum(np.abs(eigs), 1)):
+            break
+        if previous_change is not None and np.max(change) > np.max(previous_change) / 2:
+            break
+        previous_change = change
+    return eigs, errors
+
+
+def extremal_eigs(A, *, k=1, which="LM", v0=None, solver=None, precision="double"):
+    """Returns the k extremal eigenvalues of the symmetric (or Hermitian) A that
+    eigsh(A, k=k, which=which, v0=v0, return_eigenvectors=False) would, sorted in
+    ascending order, with the solver chosen by choose_solver.
+
+    Each call is timed in the instrumentation stage of the solver it used, 'dense',
+    'eigsh' or 'lobpcg', so the choices of a run show in its report. If lobpcg does
+    not converge, the eigenvalues are computed again with eigsh and the counter
+    lobpcg_fallbacks is incremented.
+
+    The precision tiers are
+        'double': float64 throughout, to machine precision.
+        'single': A is converted to float32 (complex64 if complex) and solved with
+            eigsh at a relative tolerance of 1e-5, or with a float32 eigvalsh.
+        'mixed': the float32 eigsh solve is followed by refine_eigenpairs in
+            float64. Dense solves are cheap and stay in float64.
+    Operators without an astype method are solved in float64 in every tier. The
+    achieved accuracy is recorded as the instrumentation maximum eig_error_bound:
+    the float64 residual norm of the eigenvectors for the float32 solves and the
+    lobpcg solves, which only converge to a tolerance of 1e-8, the error estimate of
+    refine_eigenpairs for the refined solves, and machine epsilon times the largest
+    eigenvalue in magnitude for the backward stable eigsh and dense solves.
+
+    Args:
+        A (np.ndarray, scipy sparse matrix or LinearOperator): The matrix.
+        k (int): The number of eigenvalues.
+        which (str): One of 'LA', 'SA' or 'LM', as in eigsh.
+        v0 (np.ndarray or None): The starting vector of the iterative solvers.
+        solver (str or None): Force 'dense', 'eigsh' or 'lobpcg'. None chooses.
+        precision (str): One of 'double', 'single' or 'mixed'.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"precision '{precision}' is invalid. Must be one of {PRECISIONS}"
+        )
+    n = A.shape[0]
+    if solver == "lobpcg" and which == "LM":
+        raise ValueError("lobpcg only supports which='LA' and which='SA'")
+    if solver is None:
+        matrix_free = not issparse(A) and isinstance(A, LinearOperator)
+        solver = choose_solver(
+            n=n,
+            nnz=A.nnz if issparse(A) else None,
+            k=k,
+            which=which,
+            matrix_free=matrix_free,
+        )
+    if solver not in ("dense", "eigsh", "lobpcg"):
+        raise ValueError(
+            f"solver '{solver}' is invalid. Must be one of 'dense', 'eigsh', 'lobpcg'"
+        )
+
+    if solver == "dense":
+        dtype = single_dtype(A.dtype) if precision == "single" else None
+        with instrumentation.stage("dense"):
+            eigs = _dense(A, k=k, which=which, dtype=dtype)
+        instrumentation.maximum(
+            "eig_error_bound",
+            np.finfo(eigs.dtype).eps * np.max(np.abs(eigs)),
+        )
+        return eigs.astype(np.float64)
+
+    A_single = _as_single(A) if precision != "double" else A
+    if A_single is A:
+        eigs = None
+        if solver == "lobpcg":
+            try:
+                with instrumentation.stage("lobpcg"):
+                    eigs, errors = _lobpcg(A, k=k, which=which, v0=v0)
+            except RuntimeError:
+                instrumentation.count("lobpcg_fallbacks")
+        if eigs is None:
+            with instrumentation.stage("eigsh"):
+                eigs = np.sort(_eigsh(A, k=k, which=which, v0=v0))
+            errors = np.finfo(np.float64).eps * np.abs(eigs)
+        instrumentation.maximum("eig_error_bound", np.max(errors))
+        return eigs
+
+    # The float32 tiers screen with eigsh, which returns the eigenvectors needed
+    # to measure and refine the accuracy
+    with instrumentation.stage("eigsh"):
+        eigs, vectors = eigsh(
+            A_single,
+            k=k,
+            which=which,
+            v0=None if v0 is None else v0.astype(A_single.dtype),
+            tol=_SINGLE_TOL,
+        )
+    vectors = vectors.astype(A.dtype)
+    eigs = eigs.astype(np.float64)
+    if precision == "mixed":
+        with instrumentation.stage("refinement"):
+            eigs, errors = refine_eigenpairs(A, vectors, eigs, which=which)
+    else:
+        errors = _residual_norms(A, vectors, eigs)
+    instrumentation.maximum("eig_error_bound", np.max(errors))
+    return np.sort(eigs)
@@ -1,11 +1,62 @@
 import numpy as np
-from scipy.sparse.linalg import eigsh
-from scipy.sparse import csr_matrix
-from scipy.sparse import dok_matrix
 from . import covers
+from . import instrumentation
+from . import permutations
+from . import spectra
+from .eigensolvers import batched_extremal_eigs
+from .eigensolvers import choose_solver
+from .eigensolvers import extremal_eigs
+from .eigensolvers import fiber_deflated_operator
+from .seeding import random_v0
+from .seeding import sample_generators
+
+# The eigsh mode that finds the eigenvalue of each eig_type once the matrix has
+# been shifted by the identity_shift used below.
+_WHICH = {"max_positive": "LA", "max_negative": "SA", "max_magnitude": "LM"}
+
+# Eigenvalues closer than this to a trivial or base eigenvalue are taken to be that
+# eigenvalue, for each precision tier of eigensolvers.extremal_eigs. The float32
+# solves are accurate to about 1e-5, the refined ones to about 1e-8.
+_SAME_EIG_TOL = {"double": 10 ** (-10), "mixed": 10 ** (-6), "single": 10 ** (-4)}
+
+
+def generate_loop_extremal_eigs(
+    *,
+    size,
+    deg,
+    number,
+    eig_type,
+    simple,
+    matrix_free=False,
+    batch_size=None,
+    deflate=False,
+    precision="double",
+    rng=None,
+):
+    """Returns the extremal non-trivial eigenvalue of number random graphs that
+    are covers of the loop.
+
+    rng is a Generator shared by all graphs, or a sequence of one Generator per
+    graph so that each graph can be regenerated on its own.
+
+    If batch_size is given, graphs are generated batch_size at a time and solved
+    together with batched_extremal_eigs, restricted to the complement of the
+    constant vector. This is much faster than one eigsh call per graph for small
+    and medium sizes, and cannot be combined with matrix_free.
+
+    If deflate is True, each eigsh call is restricted to the complement of the
+    constant vector, so it computes the one eigenvalue we need instead of two.
+
+    precision is the precision tier of eigensolvers.extremal_eigs, 'double',
+    'single' or 'mixed'. The batched and deflated solves are always in double.
 
+    For max_negative, the most negative non-trivial eigenvalue is returned. Before
+    extremal_eigs sorted its output, the eigsh path returned the second most
+    negative one, as eigsh lists the two it finds in ascending magnitude.
+    """
+    if matrix_free and batch_size is not None:
+        raise ValueError("batch_size cannot be used together with matrix_free")
 
-def generate_loop_extremal_eigs(*, size, deg, number, eig_type, simple):
     output = []
 
     if eig_type == "max_positive":
@@ -27,28 +78,98 @@ def generate_loop_extremal_eigs(*, size, deg, number, eig_type, simple):
     else:
         graph_function = covers.random_graph
 
+    rngs = sample_generators(rng, number)
+
     # With small probability, the graph will be disconnected, and return the
-    # value 4 twice.
-    count = 0
-    while count < number:
-        B = graph_function(size=size, deg=deg, identity_shift=identity_shift)
+    # value 4 twice. It is then regenerated from the same Generator.
+    if batch_size is not None:
+        for start in range(0, number, batch_size):
+            batch_rngs = rngs[start : start + batch_size]
+            batch_eigs = [None] * len(batch_rngs)
+            pending = list(range(len(batch_rngs)))
+            while len(pending) > 0:
+                graphs = [
+                    graph_function(
+                        size=size,
+                        deg=deg,
+                        identity_shift=identity_shift,
+                        rng=batch_rngs[i],
+                    )
+                    for i in pending
+                ]
+                v0 = [random_v0(batch_rngs[i], size) for i in pending]
+                with instrumentation.stage("batched_lanczos"):
+                    eigs = batched_extremal_eigs(
+                        graphs, which=_WHICH[eig_type], fiber_size=size, v0=v0
+                    )
 
-        shifted_eigs = eigsh(B, k=2, return_eigenvectors=False)
-        eigs = [x - identity_shift for x in shifted_eigs]
+                # A disconnected graph has a second eigenvector with eigenvalue deg
+                disconnected = []
+                for i, eig in zip(pending, eigs):
+                    if abs(eig - identity_shift - deg) > 10 ** (-10):
+                        batch_eigs[i] = eig - identity_shift
+                    else:
+                        disconnected.append(i)
+                instrumentation.count("disconnected_discarded", len(disconnected))
+                pending = disconnected
+            output.extend(batch_eigs)
+        return output
+
+    for sample_rng in rngs:
+        eigs = []
+        while len(eigs) == 0:
+            B = graph_function(
+                size=size,
+                deg=deg,
+                identity_shift=identity_shift,
+                as_operator=matrix_free,
+                rng=sample_rng,
+            )
+            v0 = random_v0(sample_rng, size)
+
+            if deflate:
+                B = fiber_deflated_operator(B, size)
+                shifted_eigs = extremal_eigs(
+                    B, k=1, which=_WHICH[eig_type], v0=v0, precision=precision
+                )
+            else:
+                shifted_eigs = extremal_eigs(B, k=2, v0=v0, precision=precision)
+            eigs = [x - identity_shift for x in shifted_eigs]
 
-        #            print([np.min(abs(base_eigs - eig)) for eig in eigs])
-        eigs = [eig for eig in eigs if abs(eig - deg) > 10 ** (-10)]
-        if len(eigs) > 0:
-            output.append(eigs[0])
-            count += 1
+            #            print([np.min(abs(base_eigs - eig)) for eig in eigs])
+            eigs = [eig for eig in eigs if abs(eig - deg) > _SAME_EIG_TOL[precision]]
+            if len(eigs) == 0:
+                instrumentation.count("disconnected_discarded")
+        # The most extreme of the kept eigenvalues, e.g. the most negative one for
+        # max_negative, as in the batched and deflated solves
+        output.append(max(eigs, key=lambda eig: abs(eig + identity_shift)))
 
     return output
 
 
-def generate_matrix_rep_eigs(*, size, deg, number, matrix_func, eig_type):
+def generate_matrix_rep_eigs(
+    *,
+    size,
+    deg,
+    number,
+    matrix_func,
+    eig_type,
+    batch_size=None,
+    matrix_free=False,
+    precision="double",
+    rng=None,
+):
     """Returns eigenvalues from generating random graphs of a particular
     size and degree, and replacing ones with random matrices according to
-    the matrix_func"""
+    the matrix_func. If batch_size is given, the covers are solved batch_size at a
+    time with batched_extremal_eigs. If matrix_free is True, matrix_func must be a
+    group representation and each cover is a GroupRepOperator storing one group
+    element per edge. precision is the precision tier of
+    eigensolvers.extremal_eigs, and batched solves are always in double. rng is a
+    Generator, or a sequence of one Generator per graph."""
+    if matrix_free and batch_size is not None:
+        raise ValueError("batch_size cannot be used together with matrix_free")
+
     if eig_type == "max_positive":
         id_mult = 1
     elif eig_type == "max_negative":
@@ -63,62 +184,82 @@ def generate_matrix_rep_eigs(*, size, deg, number, matrix_func, eig_type):
 
     identity_shift = id_mult * int(deg / 2)
 
-    output = []
-    for i in range(0, number):
-        base_graph = covers.random_simple_graph(size=size, deg=deg, identity_shift=0)
-
-        B = covers.random_cover_matrix_rep(
+    def random_matrix_rep_cover(sample_rng):
+        base_graph = covers.random_simple_graph(
+            size=size, deg=deg, identity_shift=0, rng=sample_rng
+        )
+        return covers.random_cover_matrix_rep(
             base_graph=base_graph,
             matrix_func=matrix_func,
             identity_shift=identity_shift,
+            as_operator=matrix_free,
+            rng=sample_rng,
         )
 
-        eig = eigsh(B, k=1, return_eigenvectors=False)[0] - identity_shift
-        output.append(eig)
+    rngs = sample_generators(rng, number)
+
+    output = []
+    if batch_size is not None:
+        for start in range(0, number, batch_size):
+            batch_rngs = rngs[start : start + batch_size]
+            covers_batch = [random_matrix_rep_cover(r) for r in batch_rngs]
+            v0 = [random_v0(r, covers_batch[0].shape[0]) for r in batch_rngs]
+            with instrumentation.stage("batched_lanczos"):
+                eigs = batched_extremal_eigs(
+                    covers_batch, which=_WHICH[eig_type], v0=v0
+                )
+            output.extend(eig - identity_shift for eig in eigs)
+        return output
+
+    for sample_rng in rngs:
+        B = random_matrix_rep_cover(sample_rng)
+        v0 = random_v0(sample_rng, B.shape[0])
+        eig = extremal_eigs(B, k=1, v0=v0, precision=precision)[0]
+        output.append(eig - identity_shift)
     return output
 
 
 def generate_new_extremal_eigs(
-    *, base_graph, cover_deg, permutation_func, number, trivial_eig, eig_type
+    *,
+    base_graph,
+    cover_deg,
+    permutation_func,
+    number,
+    trivial_eig,
+    eig_type,
+    deflate=False,
+    fourier=None,
+    batch_size=None,
+    precision="double",
+    rng=None,
 ):
-    # We want to find the base eigenvalues that we should ignore.
-    # If the base_graph is enormous, we need to be careful and
-    # compute a smaller number of eigenvalues using a sparse routine.
-    if base_graph.shape[0] < 1000:
-        if not isinstance(base_graph, np.matrix):
-            dense_base_graph = base_graph.todense()
-        else:
-            dense_base_graph = base_graph
-        base_eigs = np.linalg.eigh(dense_base_graph)[0]
-        base_eig_mag_cutoff = 0
-    else:
-
-        # If the base graph is very large, we compute the top k eigenvalues.
-        # This should overestimate the number we need. Convergence to
-        # TW has std ~C*n**(-2/3), while k/n eigs has std ~C_k*n**(-1/2)
-        if base_graph.shape[0] <= 20000:
-            num_base_eigs = 50
-        else:
-            num_base_eigs = 20
-
-        base_graph = csr_matrix(base_graph)
-        base_eigs = eigsh(base_graph, k=num_base_eigs, return_eigenvectors=False)
-
-        if eig_type == "max_positive":
-            base_eig_mag_cutoff = np.min([abs(eig) for eig in base_eigs if eig > 0])
-        elif eig_type == "max_negative":
-            base_eig_mag_cutoff = np.min([abs(eig) for eig in base_eigs if eig < 0])
-        elif eig_type == "max_magnitude":
-            base_eig_mag_cutoff = np.min([abs(eig) for eig in base_eigs])
-
-    # The random_cover function runs much faster if we first turn the base graph
-    # into a dok_matrix
-    base_graph = dok_matrix(base_graph)
-
-    output = []
-
-    # base_eig_mag_cutoff is the smallest magnitude of the relevant base eigenvalues
-    # This quantity only matters when we do not compute all of the base eigenvalues.
+    """Returns the extremal new eigenvalue of number random covers of base_graph,
+    that is the extremal eigenvalue that is not an eigenvalue of the base graph.
+    rng is a Generator, or a sequence of one Generator per cover.
+
+    By default the base spectrum is computed and filtered out of a few extremal
+    eigenvalues of each cover. Covers small enough for eigensolvers.choose_solver
+    to pick the dense solver are built batch_size at a time (by default as many as
+    fit in 64MB) into a (batch_size, n, n) array, and solved with a single stacked
+    eigvalsh. The base eigenvalues are then filtered out of the whole batch at once,
+    with the same result as the per cover solves. If deflate is True, the eigsh call
+    on each cover is instead restricted to the complement of the pull-back of all
+    functions on the base graph, so a single eigenvalue is computed and the base
+    spectrum is never needed.
+
+    Covers drawn with permutations.abelian_cycle are instead split into their
+    non-trivial character blocks (see covers.cyclic_character_blocks), which are
+    V x V Hermitian matrices whose spectra are exactly the new eigenvalues. Small
+    blocks are solved together with a stacked dense eigvalsh, large ones one at a
+    time, with the solver picked by eigensolvers.choose_solver. The base graph is
+    never solved. fourier=None picks this path whenever permutation_func is
+    abelian_cycle, and fourier=False turns it off.
+
+    precision is the precision tier of eigensolvers.extremal_eigs for the covers,
+    'double', 'single' or 'mixed'. The stacked dense solves are in float32 for
+    'single' and float64 otherwise, the base spectrum and deflated solves always in
+    float64.
+    """
     if eig_type == "max_positive":
         id_mult = 1
     elif eig_type == "max_negative":
@@ -133,6 +274,56 @@ def generate_new_extremal_eigs(
 
     identity_shift = id_mult * int(trivial_eig / 2)
 
+    if fourier is None:
+        fourier = permutation_func is permutations.abelian_cycle and not deflate
+    if fourier:
+        return _cyclic_new_extremal_eigs(
+            base_graph=base_graph,
+            cover_deg=cover_deg,
+            number=number,
+            eig_type=eig_type,
+            precision=precision,
+            rng=rng,
+        )
+
+    # Every cover shares the sparsity structure of the template, so each sample
+    # only needs new column indices
+    template = covers.CoverTemplate(
+        base_graph=base_graph,
+        cover_deg=cover_deg,
+        permutation_func=permutation_func,
+        identity_shift=identity_shift,
+    )
+
+    output = []
+    rngs = sample_generators(rng, number)
+
+    if deflate:
+        for sample_rng in rngs:
+            B = template.sample(copy=False, rng=sample_rng)
+            B = fiber_deflated_operator(B, cover_deg)
+            shifted_eig = extremal_eigs(
+                B, k=1, which=_WHICH[eig_type], v0=random_v0(sample_rng, B.shape[0])
+            )[0]
+            output.append(shifted_eig - identity_shift)
+        return output
+
+    # We want to find the base eigenvalues that we should ignore. The spectrum of
+    # a fixed base graph is only computed once, see spectra.base_spectrum
+    base_eigs, num_base_eigs = spectra.cover_base_spectrum(base_graph)
+    if num_base_eigs is None:
+        base_eig_mag_cutoff = 0
+    else:
+        if eig_type == "max_positive":
+            base_eig_mag_cutoff = np.min([abs(eig) for eig in base_eigs if eig > 0])
+        elif eig_type == "max_negative":
+            base_eig_mag_cutoff = np.min([abs(eig) for eig in base_eigs if eig < 0])
+        elif eig_type == "max_magnitude":
+            base_eig_mag_cutoff = np.min([abs(eig) for eig in base_eigs])
+
+    # base_eig_mag_cutoff is the smallest magnitude of the relevant base eigenvalues
+    # This quantity only matters when we do not compute all of the base eigenvalues.
+
     # If our number of iterations is smaller, the cost of having to compute
     # eigenvalues more than once is higher.
     # Remark: A more faster approach would be to increase num_eigs_to_get by
@@ -146,28 +337,65 @@ def generate_new_extremal_eigs(
     else:
         num_eigs_to_get = 2
 
-    for i in range(0, number):
-        B = covers.random_cover(
-            base_graph=base_graph,
-            cover_deg=cover_deg,
-            permutation_func=permutation_func,
-            identity_shift=identity_shift,
-        )
+    n = template.shape[0]
+    if (
+        base_eig_mag_cutoff == 0
+        and choose_solver(n=n, nnz=len(template.data), k=num_eigs_to_get) == "dense"
+    ):
+        if batch_size is None:
+            batch_size = max(1, 2**23 // n**2)
+        for start in range(0, number, batch_size):
+            batch_rngs = rngs[start : start + batch_size]
+            dtype = np.float32 if precision == "single" else np.float64
+            stack = np.empty((len(batch_rngs), n, n), dtype=dtype)
+            for b, sample_rng in enumerate(batch_rngs):
+                stack[b] = template.sample(copy=False, rng=sample_rng).toarray()
+                # Drawn and unused, so a Generator shared by all covers is left in
+                # the same state as by the per cover path
+                random_v0(sample_rng, n)
+            with instrumentation.stage("dense"):
+                shifted_eigs = np.linalg.eigvalsh(stack)
+            instrumentation.maximum(
+                "eig_error_bound",
+                np.finfo(dtype).eps * np.max(np.abs(shifted_eigs)),
+            )
+            with instrumentation.stage("base_filtering"):
+                output_batch, num_eigs_to_get = _filter_new_eigs(
+                    shifted_eigs.astype(np.float64) - identity_shift,
+                    identity_shift=identity_shift,
+                    base_eigs=base_eigs,
+                    num_eigs_to_get=num_eigs_to_get,
+                    tol=_SAME_EIG_TOL[precision],
+                )
+            output.extend(output_batch)
+        return output
+
+    for sample_rng in rngs:
+        B = template.sample(copy=False, rng=sample_rng)
+        v0 = random_v0(sample_rng, B.shape[0])
 
         found_new_eig = False
 
         while found_new_eig is not True:
-            shifted_eigs = eigsh(B, k=num_eigs_to_get, return_eigenvectors=False)
+            shifted_eigs = extremal_eigs(
+                B, k=num_eigs_to_get, v0=v0, precision=precision
+            )
             eigs = [x - identity_shift for x in shifted_eigs]
 
             #            print([np.min(abs(base_eigs - eig)) for eig in eigs])
-            eigs = [eig for eig in eigs if np.min(abs(base_eigs - eig)) > 10 ** (-10)]
+            with instrumentation.stage("base_filtering"):
+                eigs = [
+                    eig
+                    for eig in eigs
+                    if np.min(abs(base_eigs - eig)) > _SAME_EIG_TOL[precision]
+                ]
 
             if len(eigs) == 0:  # In this case, recompute with more eigenvalues.
                 # Note: If k is increased for a single graph in the loop, it increases
                 # for all others. With high probability, if k needs to be
                 # larger, it is due to the base graph and not the cover.
                 num_eigs_to_get += 2
+                instrumentation.count("num_eigs_to_get_increased")
             else:
                 # Append the largest magnitude eigenvalues not from the base_graph
                 lm_new_eig = sorted(eigs, key=lambda x: abs(x))[-1]
@@ -189,3 +417,109 @@ def generate_new_extremal_eigs(
                         f"Hard-coded value {num_base_eigs} of num_base_eigs too low."
                     )
     return output
+
+
+def _by_magnitude(eigs):
+    """Returns the indices that sort each row of eigs by decreasing magnitude, with
+    eigenvalues of equal magnitude up to rounding ordered by decreasing value."""
+    return np.lexsort((eigs, np.round(np.abs(eigs), 10)), axis=-1)[..., ::-1]
+
+
+def _filter_new_eigs(eigs, *, identity_shift, base_eigs, num_eigs_to_get, tol):
+    """Returns the new eigenvalue that generate_new_extremal_eigs finds for each row
+    of the full spectra eigs, together with the final num_eigs_to_get.
+
+    Each cover keeps the num_eigs_to_get eigenvalues that an eigsh call on the
+    shifted cover would compute, and returns the largest in magnitude of those that
+    are not base eigenvalues, i.e. are further than tol from all of them. As in the
+    per cover loop, num_eigs_to_get grows by 2 for this and all later covers
+    whenever none of them is new.
+    """
+    shifted = eigs + identity_shift
+    ranked = np.take_along_axis(eigs, _by_magnitude(shifted), axis=1)
+
+    # Distance of every eigenvalue to the nearest base eigenvalue
+    base_sorted = np.sort(np.ravel(base_eigs))
+    position = np.searchsorted(base_sorted, ranked)
+    below = base_sorted[np.clip(position - 1, 0, len(base_sorted) - 1)]
+    above = base_sorted[np.clip(position, 0, len(base_sorted) - 1)]
+    is_new = np.minimum(np.abs(ranked - below), np.abs(ranked - above)) > tol
+
+    output = []
+    for row, row_is_new in zip(ranked, is_new):
+        if not row_is_new.any():
+            raise RuntimeError("A cover has no eigenvalues that are not base ones")
+        while not row_is_new[:num_eigs_to_get].any():
+            num_eigs_to_get += 2
+            instrumentation.count("num_eigs_to_get_increased")
+        candidates = row[:num_eigs_to_get][row_is_new[:num_eigs_to_get]]
+        output.append(candidates[_by_magnitude(candidates)[0]])
+    return output, num_eigs_to_get
+
+
+def _cyclic_new_extremal_eigs(
+    *, base_graph, cover_deg, number, eig_type, precision, rng
+):
+    """The character block path of generate_new_extremal_eigs for cyclic covers."""
+    if cover_deg < 2:
+        raise ValueError("A cyclic cover of degree 1 has no new eigenvalues")
+
+    row, col, num_vertices = covers.base_edges(base_graph)
+
+    output = []
+    for sample_rng in sample_generators(rng, number):
+        # The same draw as the abelian_cycles shifts of a cover from CoverTemplate
+        shifts = sample_rng.integers(cover_deg, size=len(row))
+        with instrumentation.stage("character_blocks"):
+            blocks = covers.cyclic_character_blocks(
+                row=row,
+                col=col,
+                num_vertices=num_vertices,
+                cover_deg=cover_deg,
+                shifts=shifts,
+            )
+
+        solver = choose_solver(n=num_vertices, nnz=blocks[0].nnz, k=1)
+        if solver == "dense":
+            with instrumentation.stage("dense"):
+                stack = np.stack([b.toarray() for b in blocks])
+                if precision == "single":
+                    stack = stack.astype(np.complex64)
+                eigs = np.linalg.eigvalsh(stack).astype(np.float64)
+            instrumentation.maximum(
+                "eig_error_bound",
+                np.finfo(stack.dtype).eps * np.max(np.abs(eigs)),
+            )
+            lowest, highest = eigs[:, 0], eigs[:, -1]
+        else:
+            v0 = random_v0(sample_rng, num_vertices).astype(complex)
+            lowest, highest = [], []
+            for block in blocks:
+                if eig_type != "max_positive":
+                    lowest.append(
+                        extremal_eigs(
+                            block,
+                            which="SA",
+                            v0=v0,
+                            solver=solver,
+                            precision=precision,
+                        )[0]
+                    )
+                if eig_type != "max_negative":
+                    highest.append(
+                        extremal_eigs(
+                            block,
+                            which="LA",
+                            v0=v0,
+                            solver=solver,
+                            precision=precision,
+                        )[0]
+                    )
+
+        if eig_type == "max_positive":
+            output.append(np.max(highest))
+        elif eig_type == "max_negative":
+            output.append(np.min(lowest))
+        else:
+            output.append(max(np.max(highest), np.min(lowest), key=abs))
+    return output
@@ -0,0 +1,95 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Code is wrapped in stage("name") blocks, which add their wall time and a call to
+# the totals of that stage, events are counted with count("name"), and the largest
+# value of a quantity is kept with maximum("name", value). All only touch a dict,
+# so this is cheap enough to leave on in production. Workers take a snapshot after
+# each piece of work and the runner combines them with merge.
+_stage_seconds = defaultdict(float)
+_stage_calls = defaultdict(int)
+_counters = defaultdict(int)
+_maxima = {}
+
+
+@contextmanager
+def stage(name):
+    """Context manager adding the wall time of its block to the stage name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage_seconds[name] += time.perf_counter() - start
+        _stage_calls[name] += 1
+
+
+def count(name, value=1):
+    """Adds value to the counter name."""
+    _counters[name] += value
+
+
+def maximum(name, value):
+    """Keeps the largest value recorded under name."""
+    _maxima[name] = max(_maxima.get(name, value), value)
+
+
+def snapshot():
+    """Returns the totals recorded in this process since the last reset.
+
+    Returns:
+        dict: {"stages": {name: {"seconds": float, "calls": int}},
+            "counters": {name: int}, "maxima": {name: float}}, which is json
+            serializable.
+    """
+    return {
+        "stages": {
+            name: {"seconds": _stage_seconds[name], "calls": _stage_calls[name]}
+            for name in _stage_seconds
+        },
+        "counters": dict(_counters),
+        "maxima": {name: float(value) for name, value in _maxima.items()},
+    }
+
+
+def reset():
+    """Clears all stages and counters of this process."""
+    _stage_seconds.clear()
+    _stage_calls.clear()
+    _counters.clear()
+    _maxima.clear()
+
+
+def merge(snapshots):
+    """Returns the sum of several snapshots, e.g. from different workers, with the
+    largest of their maxima."""
+    merged = {"stages": {}, "counters": defaultdict(int), "maxima": {}}
+    for snap in snapshots:
+        for name, totals in snap["stages"].items():
+            merged_totals = merged["stages"].setdefault(
+                name, {"seconds": 0.0, "calls": 0}
+            )
+            merged_totals["seconds"] += totals["seconds"]
+            merged_totals["calls"] += totals["calls"]
+        for name, value in snap["counters"].items():
+            merged["counters"][name] += value
+        # Snapshots from before maxima were recorded have none
+        for name, value in snap.get("maxima", {}).items():
+            merged["maxima"][name] = max(merged["maxima"].get(name, value), value)
+    merged["counters"] = dict(merged["counters"])
+    return merged
+
+
+def report(snap):
+    """Returns a snapshot as readable lines, the slowest stages first."""
+    lines = []
+    stages = sorted(snap["stages"].items(), key=lambda item: -item[1]["seconds"])
+    for name, totals in stages:
+        lines.append(
+            f"  {name:<32} {totals['seconds']:10.2f}s {totals['calls']:>10} calls"
+        )
+    for name, value in sorted(snap["counters"].items()):
+        lines.append(f"  {name:<32} {value:>11}")
+    for name, value in sorted(snap.get("maxima", {}).items()):
+        lines.append(f"  {name:<32} {value:>11.3g} max")
+    return "\n".join(lines)
@@ -1,11 +1,142 @@
+import functools as _functools
+import itertools as _itertools
+
 import numpy as _np
+from .seeding import as_generator as _as_generator
 
 
-def quaternion_matrix_rep():
-    """This function returns on of 8 4x4 matrices corresponding to the
-    Real irreducible representation of the Quaternion group"""
+class GroupRep:
+    """A real orthogonal matrix representation of a finite group, tabulated once.
+
+    The matrices of all group elements are stored in a table of shape
+    (order, dim, dim), so a random element is drawn as an integer index and its
+    matrix is a lookup. The indices use the smallest integer type that holds the
+    order, which lets a cover store the element of each edge in one or two bytes.
+    A GroupRep can also be called like a matrix function, as group(rng=rng).
+
+    Args:
+        name (str): The name of the group.
+        matrices (sequence of np.ndarray): The matrices of the group elements.
+    """
+
+    def __init__(self, name, matrices):
+        self.name = name
+        self.table = _np.array(matrices, dtype=float)
+        # The reps are cached and shared by every caller, so the matrices handed
+        # out as views of the table must not be written to
+        self.table.flags.writeable = False
+        self.order, self.dim, _ = self.table.shape
+        if self.order <= _np.iinfo(_np.int8).max:
+            self.index_dtype = _np.int8
+        elif self.order <= _np.iinfo(_np.int16).max:
+            self.index_dtype = _np.int16
+        else:
+            self.index_dtype = _np.int32
+
+    def __repr__(self):
+        return f"GroupRep({self.name!r}, order={self.order}, dim={self.dim})"
+
+    def __call__(self, rng=None):
+        """Returns the matrix of a uniformly random group element, as a read-only
+        view of the table."""
+        return self.table[_as_generator(rng).integers(0, self.order)]
+
+    def sample_indices(self, number, rng=None):
+        """Returns the indices of number uniformly random group elements."""
+        return _as_generator(rng).integers(
+            0, self.order, size=number, dtype=self.index_dtype
+        )
+
+    def sample(self, number, rng=None):
+        """Returns the matrices of number uniformly random group elements as an
+        array of shape (number, dim, dim)."""
+        return self.table[self.sample_indices(number, rng=rng)]
+
+
+def _rotation(angle):
+    return _np.array(
+        [[_np.cos(angle), -_np.sin(angle)], [_np.sin(angle), _np.cos(angle)]]
+    )
+
+
+def _reflection(angle):
+    return _np.array(
+        [[_np.cos(angle), _np.sin(angle)], [_np.sin(angle), -_np.cos(angle)]]
+    )
+
+
+@_functools.lru_cache(maxsize=None)
+def quaternion_rep():
+    """Returns the real irreducible 4 dimensional representation of the Quaternion
+    group."""
     i = _np.array([[0.0, -1, 0, 0], [1, 0, 0, 0], [0, 0, 0, -1], [0, 0, 1, 0]])
     j = _np.array([[0.0, 0, -1, 0], [0, 0, 0, 1], [1, 0, 0, 0], [0, -1, 0, 0]])
     k = _np.array([[0.0, 0, 0, -1], [0, 0, -1, 0], [0, 1, 0, 0], [1, 0, 0, 0]])
-    rep_list = [_np.eye(4), -_np.eye(4), i, -i, j, -j, k, -k]
-    return rep_list[_np.random.randint(0, len(rep_list))]
+    return GroupRep("quaternion", [_np.eye(4), -_np.eye(4), i, -i, j, -j, k, -k])
+
+
+@_functools.lru_cache(maxsize=None)
+def cyclic_rep(n):
+    """Returns the representation of the cyclic group of order n by rotations of the
+    plane by multiples of 2*pi/n."""
+    return GroupRep(f"cyclic{n}", [_rotation(2 * _np.pi * k / n) for k in range(n)])
+
+
+@_functools.lru_cache(maxsize=None)
+def dihedral_rep(n):
+    """Returns the representation of the dihedral group of order 2n as the
+    symmetries of the regular n-gon."""
+    angles = [2 * _np.pi * k / n for k in range(n)]
+    return GroupRep(
+        f"dihedral{n}",
+        [_rotation(angle) for angle in angles]
+        + [_reflection(angle) for angle in angles],
+    )
+
+
+@_functools.lru_cache(maxsize=None)
+def symmetric_standard_rep(n):
+    """Returns the standard n - 1 dimensional representation of the symmetric group
+    S_n, i.e. the permutation matrices restricted to the vectors summing to zero."""
+    # Orthonormal basis of the vectors summing to zero
+    basis = _np.linalg.qr(_np.eye(n) - 1 / n)[0][:, : n - 1]
+    matrices = []
+    for perm in _itertools.permutations(range(n)):
+        permutation_matrix = _np.zeros((n, n))
+        permutation_matrix[list(perm), range(n)] = 1
+        matrices.append(basis.T @ permutation_matrix @ basis)
+    return GroupRep(f"symmetric{n}", matrices)
+
+
+def quaternion_matrix_rep(rng=None):
+    """This function returns on of 8 4x4 matrices corresponding to the
+    Real irreducible representation of the Quaternion group"""
+    return quaternion_rep()(rng=rng)
+
+
+# Matrix functions that draw uniformly random elements of a tabulated group.
+_GROUPS = {quaternion_matrix_rep: quaternion_rep}
+
+
+def as_group_rep(matrix_func):
+    """Returns the GroupRep that matrix_func draws from, or None if it is not known
+    to draw uniformly random group elements."""
+    if isinstance(matrix_func, GroupRep):
+        return matrix_func
+    group = _GROUPS.get(matrix_func)
+    return group() if group is not None else None
+
+
+def batch_matrix_reps(matrix_func, number, rng=None):
+    """Returns number matrices drawn from matrix_func as an array of shape
+    (number, size, size).
+
+    Group representations are drawn as one array of element indices and gathered
+    from their table, all other matrix functions are called once per matrix as
+    matrix_func(rng=rng).
+    """
+    rng = _as_generator(rng)
+    group = as_group_rep(matrix_func)
+    if group is not None:
+        return group.sample(number, rng=rng)
+    return _np.stack([matrix_func(rng=rng) for _ in range(number)])
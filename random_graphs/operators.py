@@ -0,0 +1,162 @@
+import copy
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import LinearOperator
+
+
+class PermutationOperator(LinearOperator):
+    """The shifted adjacency matrix of a random cover, applied without storing it.
+
+    The edge (i, j) of the base graph with permutation p joins the cover vertices
+    cover_deg*i + k and cover_deg*j + p[k], so a cover is fully described by its base
+    edge list and one permutation per edge. The matvec is
+    shift*x + sum_e (x[p_e] + x[p_e^-1]) on the fibers of each edge, computed with
+    gathers over int32 index arrays. For covers of the loop the base edge list is
+    trivial and only the deg/2 permutation arrays are stored.
+
+    Args:
+        row (np.ndarray): The first endpoint of each base edge.
+        col (np.ndarray): The second endpoint of each base edge.
+        num_vertices (int): The number of vertices of the base graph.
+        random_perms (np.ndarray): Array of shape (len(row), cover_deg) holding the
+            permutation of each edge.
+        identity_shift (float): Shift the operator by x*I for some x, where I is the
+            identity matrix.
+    """
+
+    def __init__(self, *, row, col, num_vertices, random_perms, identity_shift):
+        num_edges, cover_deg = random_perms.shape
+        n = num_vertices * cover_deg
+        super().__init__(dtype=np.float64, shape=(n, n))
+
+        index_dtype = np.int32 if n < 2**31 else np.int64
+        perms_inv = np.empty_like(random_perms)
+        perms_inv[np.arange(num_edges)[:, None], random_perms] = np.arange(cover_deg)
+
+        self.identity_shift = identity_shift
+        self.num_vertices = num_vertices
+        self.cover_deg = cover_deg
+
+        # Position cover_deg*i + k of the output gathers the entries listed in row e
+        # of forward_index when row[e] = i, and likewise for reverse_index and col.
+        self._forward_index = (cover_deg * col[:, None] + random_perms).astype(
+            index_dtype
+        )
+        self._reverse_index = (cover_deg * row[:, None] + perms_inv).astype(index_dtype)
+
+        if num_vertices > 1:
+            edges = np.arange(num_edges)
+            ones = np.ones(num_edges)
+            shape = (num_vertices, num_edges)
+            self._forward_sum = csr_matrix((ones, (row, edges)), shape=shape)
+            self._reverse_sum = csr_matrix((ones, (col, edges)), shape=shape)
+
+    def _matvec(self, x):
+        x = np.ravel(x)
+        y = self.identity_shift * x
+
+        if self.num_vertices == 1:
+            # Covers of the loop: every permutation acts on the whole vector
+            for index in self._forward_index:
+                y += x[index]
+            for index in self._reverse_index:
+                y += x[index]
+        else:
+            y += (
+                self._forward_sum @ x[self._forward_index]
+                + self._reverse_sum @ x[self._reverse_index]
+            ).ravel()
+        return y
+
+    def _rmatvec(self, x):
+        return self._matvec(x)
+
+    def _adjoint(self):
+        return self
+
+    def astype(self, dtype):
+        """Returns a copy whose matvecs are computed in dtype, e.g. float32 to halve
+        the memory traffic. The index arrays are shared."""
+        other = copy.copy(self)
+        other.dtype = np.dtype(dtype)
+        if self.num_vertices > 1:
+            other._forward_sum = self._forward_sum.astype(dtype)
+            other._reverse_sum = self._reverse_sum.astype(dtype)
+        return other
+
+
+class GroupRepOperator(LinearOperator):
+    """The shifted adjacency matrix of a matrix-rep cover, applied without storing
+    its blocks.
+
+    The edge (i, j) of the base graph, with i > j, carrying the group element g has
+    block (j, i) equal to the matrix M_g of g and block (i, j) equal to M_g^T, as in
+    random_cover_matrix_rep. The cover is stored as the base edge list and one small
+    integer index into the table of the group per edge. The matvec groups the edges
+    by element, so each element's matrix is applied to all its edges at once.
+
+    Args:
+        row (np.ndarray): The first endpoint i of each base edge.
+        col (np.ndarray): The second endpoint j of each base edge.
+        num_vertices (int): The number of vertices of the base graph.
+        group (GroupRep): The representation the edge elements act through.
+        elements (np.ndarray): The index of the group element of each edge.
+        identity_shift (float): Shift the operator by x*I for some x, where I is the
+            identity matrix.
+    """
+
+    def __init__(self, *, row, col, num_vertices, group, elements, identity_shift):
+        n = num_vertices * group.dim
+        super().__init__(dtype=np.float64, shape=(n, n))
+
+        self.identity_shift = identity_shift
+        self.num_vertices = num_vertices
+        self.group = group
+        self.elements = elements
+        self._row = row
+        self._col = col
+        self._table = group.table
+
+        order = np.argsort(elements, kind="stable")
+        bounds = np.searchsorted(elements[order], np.arange(group.order + 1))
+        self._edges_by_element = [
+            (g, order[bounds[g] : bounds[g + 1]])
+            for g in range(group.order)
+            if bounds[g + 1] > bounds[g]
+        ]
+
+        edges = np.arange(len(row))
+        ones = np.ones(len(row))
+        shape = (num_vertices, len(row))
+        self._row_sum = csr_matrix((ones, (row, edges)), shape=shape)
+        self._col_sum = csr_matrix((ones, (col, edges)), shape=shape)
+
+    def _matvec(self, x):
+        x = np.ravel(x).reshape(self.num_vertices, self.group.dim)
+        to_col = np.empty((len(self._row), self.group.dim), dtype=self.dtype)
+        to_row = np.empty_like(to_col)
+        for g, edges in self._edges_by_element:
+            matrix = self._table[g]
+            # Vertex j gets M_g x_i and vertex i gets M_g^T x_j
+            to_col[edges] = x[self._row[edges]] @ matrix.T
+            to_row[edges] = x[self._col[edges]] @ matrix
+
+        y = self.identity_shift * x + self._col_sum @ to_col + self._row_sum @ to_row
+        return y.ravel()
+
+    def _rmatvec(self, x):
+        return self._matvec(x)
+
+    def _adjoint(self):
+        return self
+
+    def astype(self, dtype):
+        """Returns a copy whose matvecs are computed in dtype, e.g. float32 to halve
+        the memory traffic. The edge arrays are shared."""
+        other = copy.copy(self)
+        other.dtype = np.dtype(dtype)
+        other._table = self.group.table.astype(dtype)
+        other._row_sum = self._row_sum.astype(dtype)
+        other._col_sum = self._col_sum.astype(dtype)
+        return other
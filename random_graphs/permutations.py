@@ -1,41 +1,66 @@
 import numpy as _np  # Underscore to not polute namespace
+from . import instrumentation as _instrumentation
+from .seeding import as_generator as _as_generator
 
 
-def abelian_cycle(n):
+def abelian_cycle(n, rng=None):
     """Returns one of n possible cycles that permute 1 to n.
     Corresponds to the group action of the elements of an abelian group.
     """
     x = _np.arange(n)
-    y = _np.random.randint(n)
+    y = _as_generator(rng).integers(n)
     return _np.append(x[y:], x[:y])
 
 
-def derangement(n):
+def abelian_cycles(n, number, rng=None):
+    """Returns number independent outputs of abelian_cycle(n) as the rows of
+    an array of shape (number, n)."""
+    shifts = _as_generator(rng).integers(n, size=number)
+    return (_np.arange(n) + shifts[:, None]) % n
+
+
+def uniform_permutation(n, rng=None):
+    """Returns a uniformly random permutation of 1 to n."""
+    return _as_generator(rng).permutation(n)
+
+
+def uniform_permutations(n, number, rng=None):
+    """Returns number independent uniformly random permutations of 1 to n as the
+    rows of an array of shape (number, n)."""
+    rows = _np.broadcast_to(_np.arange(n), (number, n))
+    return _as_generator(rng).permuted(rows, axis=1)
+
+
+def derangement(n, rng=None):
     """Returns a random permutation that has no fixed points"""
-    new_perm = _np.random.permutation(n)
+    rng = _as_generator(rng)
+    new_perm = rng.permutation(n)
     to_avoid = _np.arange(n)
 
     coords_to_change = _np.where(to_avoid == new_perm)[0]
     while len(coords_to_change) != 0:
+        _instrumentation.count("derangement_rounds")
         if len(coords_to_change) == 1:
-            swap = _np.random.randint(0, n)
+            swap = rng.integers(0, n)
             new_perm[[coords_to_change[0], swap]] = new_perm[
                 [swap, coords_to_change[0]]
             ]
         else:
-            swap = coords_to_change[_np.random.permutation(len(coords_to_change))]
+            swap = coords_to_change[rng.permutation(len(coords_to_change))]
             new_perm[coords_to_change] = new_perm[swap]
         coords_to_change = _np.where(to_avoid == new_perm)[0]
     return new_perm
 
 
-def derangement_avoiding_others(N, perms_to_avoid):
+def derangement_avoiding_others(N, perms_to_avoid, rng=None):
     """Creates a random permutation that avoids others
     Used to force a graph to be simple."""
-    new_perm = _np.random.permutation(N)
+    rng = _as_generator(rng)
+    new_perm = rng.permutation(N)
 
     num_bad_coords = N
     while num_bad_coords > 0:
+        _instrumentation.count("derangement_avoiding_others_rounds")
         # Numpy argsort corresponds to inverting the permutation
         # For covers of the loop, because the adjacency matrix is forced
         # to be symmetric, we are effectively using perm and perm_inv.
@@ -64,8 +89,144 @@ def derangement_avoiding_others(N, perms_to_avoid):
         if len(coords_to_change) > 0:
             if len(good_coords) > 0:
                 coords_to_change = _np.append(
-                    coords_to_change, _np.random.choice(good_coords, 1)
+                    coords_to_change, rng.choice(good_coords, 1)
                 )
-            swap = coords_to_change[_np.random.permutation(len(coords_to_change))]
+            swap = coords_to_change[rng.permutation(len(coords_to_change))]
             new_perm[coords_to_change] = new_perm[swap]
     return new_perm
+
+
+# Permutation functions with a vectorized equivalent that draws many
+# permutations in a single call.
+_BATCHED = {
+    _np.random.permutation: uniform_permutations,
+    uniform_permutation: uniform_permutations,
+    abelian_cycle: abelian_cycles,
+}
+
+
+def batch_permutations(permutation_func, n, number, rng=None):
+    """Returns number permutations of 1 to n drawn from permutation_func, as the
+    rows of an array of shape (number, n).
+
+    Known permutation functions are drawn in one vectorized call, all others are
+    called once per row as permutation_func(n, rng=rng).
+    """
+    rng = _as_generator(rng)
+    batched = _BATCHED.get(permutation_func)
+    if batched is not None:
+        return batched(n, number, rng=rng)
+    if number == 0:
+        return _np.empty((0, n), dtype=int)
+    return _np.stack([permutation_func(n, rng=rng) for _ in range(number)])
+
+
+# Swap repair only runs away for graphs with degree comparable to their size, where
+# it is cheaper to give up on it after this many rounds.
+_MAX_SWAP_ROUNDS = 100
+
+
+def _conflicts(coords, perm, perm_inv, perms, perms_inv):
+    """Returns which of the coords of perm would make the graph of perm together with
+    perms non-simple, i.e. give a loop, a repeated edge, or a 2-cycle."""
+    new = perm[coords]
+    new_inv = perm_inv[coords]
+    cond = new == new_inv
+    for other, other_inv in zip(perms, perms_inv):
+        other = other[coords]
+        other_inv = other_inv[coords]
+        cond |= (
+            (new == other)
+            | (new == other_inv)
+            | (new_inv == other)
+            | (new_inv == other_inv)
+        )
+    return cond
+
+
+def simple_permutations(n, number, return_stats=False, rng=None):
+    """Returns number permutations of 1 to n whose union is a simple graph, i.e. the
+    graph joining k to p[k] for every permutation p has no loops or multiple edges.
+
+    Each permutation starts uniformly random and conflicting coordinates are
+    repaired by swapping their images with random partners. A swap of coordinates
+    x and y only changes the permutation at x and y and its inverse at the two
+    swapped values, so only those four coordinates are rechecked. The inverses of
+    the accepted permutations are computed once and cached. When the graph is so
+    dense that the swaps create conflicts faster than they repair them, the
+    permutation is instead drawn with derangement_avoiding_others.
+
+    Args:
+        n (int): The size of the permutations.
+        number (int): The number of permutations.
+        return_stats (bool): If True, also return the number of repair rounds, the
+            number of conflicting coordinates that were repaired, and the number of
+            permutations that fell back to derangement_avoiding_others.
+        rng (np.random.Generator or None): The random number generator.
+
+    Returns:
+        np.ndarray: Array of shape (number, n) with one permutation per row, and a
+            dict with the keys 'rounds', 'conflicts_repaired' and 'fallbacks' if
+            return_stats.
+    """
+    if n <= 2 * number:
+        raise ValueError(
+            f"A simple {2 * number}-regular graph needs more than {n} vertices"
+        )
+
+    rng = _as_generator(rng)
+    perms = _np.empty((number, n), dtype=int)
+    perms_inv = _np.empty((number, n), dtype=int)
+    arange = _np.arange(n)
+    rounds = 0
+    conflicts_repaired = 0
+    fallbacks = 0
+
+    for k in range(number):
+        perm = perms[k]
+        perm_inv = perms_inv[k]
+        perm[:] = rng.permutation(n)
+        perm_inv[perm] = arange
+
+        to_check = arange
+        bad = to_check[_conflicts(to_check, perm, perm_inv, perms[:k], perms_inv[:k])]
+        perm_rounds = 0
+        while len(bad) > 0:
+            if perm_rounds == _MAX_SWAP_ROUNDS:
+                fallbacks += 1
+                perm[:] = derangement_avoiding_others(n, perms[:k], rng=rng)
+                perm_inv[perm] = arange
+                break
+            perm_rounds += 1
+            rounds += 1
+            partners = rng.integers(0, n, size=len(bad))
+
+            # Only swap disjoint pairs this round, the others wait for the next one
+            _, index, counts = _np.unique(
+                _np.append(bad, partners), return_inverse=True, return_counts=True
+            )
+            disjoint = (counts[index[: len(bad)]] == 1) & (
+                counts[index[len(bad) :]] == 1
+            )
+            x = bad[disjoint]
+            y = partners[disjoint]
+            conflicts_repaired += len(x)
+
+            perm[x], perm[y] = perm[y], perm[x]
+            perm_inv[perm[x]] = x
+            perm_inv[perm[y]] = y
+
+            to_check = _np.unique(_np.concatenate([bad, y, perm[x], perm[y]]))
+            bad = to_check[
+                _conflicts(to_check, perm, perm_inv, perms[:k], perms_inv[:k])
+            ]
+
+    _instrumentation.count("simple_permutations_rounds", rounds)
+    _instrumentation.count("simple_permutations_fallbacks", fallbacks)
+    if return_stats:
+        return perms, {
+            "rounds": rounds,
+            "conflicts_repaired": conflicts_repaired,
+            "fallbacks": fallbacks,
+        }
+    return perms
@@ -0,0 +1,71 @@
+import hashlib
+
+import numpy as np
+
+
+def as_generator(rng=None):
+    """Returns rng as a np.random.Generator.
+
+    Args:
+        rng (np.random.Generator, np.random.SeedSequence, int or None): A Generator is
+            returned as is, anything else seeds a new one. None gives fresh entropy.
+    """
+    if isinstance(rng, np.random.Generator):
+        return rng
+    return np.random.default_rng(rng)
+
+
+def sample_generators(rng, number):
+    """Returns one Generator for each of number samples.
+
+    Args:
+        rng (np.random.Generator, sequence of np.random.Generator or None): A sequence
+            must hold one Generator per sample, and lets every sample be regenerated
+            on its own. A single Generator (or None) is shared by all samples.
+        number (int): The number of samples.
+
+    Returns:
+        list of np.random.Generator
+    """
+    if isinstance(rng, (list, tuple)):
+        if len(rng) != number:
+            raise ValueError(f"Got {len(rng)} Generators for {number} samples")
+        return list(rng)
+    return [as_generator(rng)] * number
+
+
+def sample_rng(entropy, index):
+    """Returns the Generator of sample index of an experiment with root seed entropy.
+
+    This is the Generator of child index of SeedSequence(entropy).spawn, built
+    directly so any sample can be regenerated without spawning the others.
+    """
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(index,)))
+
+
+def experiment_entropy(seed, key):
+    """Returns the root entropy of the experiment identified by key in a run with
+    root seed seed.
+
+    A sweep runs every size and cover degree with the same seed, so without mixing
+    in key, sample i of every point would draw from the same stream and the points
+    would be correlated. The same seed and key always give the same entropy, so
+    shards and resumed runs agree.
+
+    Args:
+        seed (int or None): The root seed. None draws fresh entropy.
+        key (str): Identifies the experiment, e.g. its script and parameters.
+
+    Returns:
+        int: The entropy for sample_rng.
+    """
+    if seed is None:
+        return np.random.SeedSequence().entropy
+    digest = hashlib.sha256(f"{seed}:{key}".encode()).digest()
+    return int.from_bytes(digest[:16], "little")
+
+
+def random_v0(rng, n):
+    """Returns a random starting vector for eigsh, which otherwise draws its own from
+    ARPACK's internal random state and is not reproducible."""
+    return rng.uniform(-1, 1, size=n)
@@ -0,0 +1,139 @@
+import collections
+import hashlib
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+from scipy.sparse.linalg import eigsh
+from . import instrumentation
+from .cache import cache_dir, save_npz_atomic
+from .eigensolvers import choose_solver
+from .seeding import random_v0
+
+# The number of base spectra kept in memory by each process
+_MEMORY_CACHE_SIZE = 32
+_memory_cache = collections.OrderedDict()
+
+
+def content_hash(A):
+    """Returns a hex digest of the shape and entries of the matrix A, which is the
+    same for every format and storage order of the same matrix."""
+    A = csr_matrix(A, dtype=np.float64)
+    if not A.has_canonical_format:
+        # A may hold read-only views, e.g. of arrays shared between processes
+        A = A.copy()
+        A.sum_duplicates()
+    digest = hashlib.sha256()
+    digest.update(np.array(A.shape, dtype=np.int64).tobytes())
+    digest.update(A.indptr.astype(np.int64).tobytes())
+    digest.update(A.indices.astype(np.int64).tobytes())
+    digest.update(A.data.tobytes())
+    return digest.hexdigest()
+
+
+def _compute(A, k, eigenvectors):
+    if k is None:
+        dense = A.toarray() if issparse(A) else np.asarray(A, dtype=float)
+        if eigenvectors:
+            return np.linalg.eigh(dense)
+        return np.linalg.eigh(dense)[0], None
+
+    # A fixed starting vector keeps the base spectrum reproducible without
+    # drawing from the Generators of the covers
+    result = eigsh(
+        csr_matrix(A, dtype=np.float64),
+        k=k,
+        v0=random_v0(np.random.default_rng(0), A.shape[0]),
+        return_eigenvectors=eigenvectors,
+    )
+    if not eigenvectors:
+        return np.sort(result), None
+    order = np.argsort(result[0])
+    return result[0][order], result[1][:, order]
+
+
+def base_spectrum(base_graph, *, k=None, eigenvectors=False, disk=True):
+    """Returns the spectrum of base_graph, computed once and cached.
+
+    Every cover of a base graph needs its spectrum, and scripts like
+    complete_cover solve many batches of covers of one fixed base. The spectrum is
+    looked up by a hash of the contents of base_graph and the request, first in a
+    per-process LRU cache, then in the .npz files under cache_dir("base_spectra"),
+    which all workers share. Only a miss in both computes it. The instrumentation
+    counters base_spectrum_memory_hits and base_spectrum_disk_hits record the hits,
+    and the stage base_eigs times the computations.
+
+    Args:
+        base_graph (np.ndarray, np.matrix or scipy sparse matrix): The symmetric
+            adjacency matrix.
+        k (int or None): If None, all eigenvalues from a dense eigh. Otherwise the
+            k largest magnitude ones from eigsh, with a fixed starting vector.
+        eigenvectors (bool): Whether to also return the eigenvectors, e.g. to
+            deflate the base spectrum.
+        disk (bool): Whether to use the on-disk store.
+
+    Returns:
+        np.ndarray or (np.ndarray, np.ndarray): The eigenvalues in ascending order,
+            and if eigenvectors is True the matching eigenvectors as columns.
+    """
+    key = f"{content_hash(base_graph)}_{'all' if k is None else k}"
+    if eigenvectors:
+        key += "_vectors"
+
+    if key in _memory_cache:
+        _memory_cache.move_to_end(key)
+        instrumentation.count("base_spectrum_memory_hits")
+        eigs, vectors = _memory_cache[key]
+    else:
+        path = os.path.join(cache_dir("base_spectra"), f"{key}.npz")
+        if disk and os.path.exists(path):
+            instrumentation.count("base_spectrum_disk_hits")
+            with np.load(path) as saved:
+                eigs = saved["eigs"]
+                vectors = saved["vectors"] if eigenvectors else None
+        else:
+            with instrumentation.stage("base_eigs"):
+                eigs, vectors = _compute(base_graph, k, eigenvectors)
+            if disk:
+                arrays = {"eigs": eigs}
+                if eigenvectors:
+                    arrays["vectors"] = vectors
+                save_npz_atomic(path, **arrays)
+
+        _memory_cache[key] = (eigs, vectors)
+        if len(_memory_cache) > _MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+    if eigenvectors:
+        return eigs, vectors
+    return eigs
+
+
+def cover_base_spectrum(base_graph):
+    """Returns the base eigenvalues generate_new_extremal_eigs filters out of the
+    spectra of covers of base_graph.
+
+    Small base graphs get their full spectrum. If the base graph is enormous, we
+    need to be careful and compute a smaller number of eigenvalues using a sparse
+    routine: the top k eigenvalues, which should overestimate the number we need.
+    Convergence to TW has std ~C*n**(-2/3), while k/n eigs has std ~C_k*n**(-1/2).
+    Calling it in the parent before starting workers saves them from all
+    computing the spectrum at once.
+
+    Returns:
+        (np.ndarray, int or None): The eigenvalues in ascending order, and their
+            number k, or None for the full spectrum.
+    """
+    n = base_graph.shape[0]
+    num_base_eigs = min(50 if n <= 20000 else 20, n)
+    nnz = np.count_nonzero(base_graph) if isinstance(base_graph, np.ndarray) else None
+    if nnz is None:
+        nnz = base_graph.nnz
+    if choose_solver(n=n, nnz=nnz, k=num_base_eigs) == "dense":
+        return base_spectrum(base_graph), None
+    return base_spectrum(base_graph, k=num_base_eigs), num_base_eigs
+
+
+def clear_memory_cache():
+    """Empties the in-memory cache of base_spectrum of this process."""
+    _memory_cache.clear()
@@ -1,6 +1,11 @@
+import functools
+import multiprocessing
+import os
+
 import numpy as np
-from scipy import stats
+from scipy import special
 from TracyWidom import TracyWidom
+from . import cache
 
 
 def expected_std_scaling(degree, tw_type):
@@ -20,27 +25,153 @@ def expected_std_scaling(degree, tw_type):
     return tw_std * np.sqrt(degree - 1) * extra_factor
 
 
-def tracywidom_ks_test(x):
-    """For an array x, returns the Kolmogorov-Smirnov-test for x normalized"""
-    x = np.array(x)
-    normed_list = sorted(list((x - np.mean(x)) / np.std(x)))
-    tw1 = TracyWidom(beta=1)
-    tw2 = TracyWidom(beta=2)
-    tw4 = TracyWidom(beta=4)
+# The mean and variance of the Tracy Widom distributions, used to make them mean 0
+# and std 1 for the ks-test.
+_TW_MOMENTS = {
+    1: (-1.2065335745820, 1.607781034581),
+    2: (-1.771086807411, 0.8131947928329),
+    4: (-2.306884893241, 0.5177237207726),
+}
+
+# The Tracy Widom cdf and pdf are tabulated on this grid, which holds all but
+# about 1e-20 of their mass. Linear interpolation on it is accurate to ~1e-7.
+_TW_GRID = (-12.0, 8.0, 20001)
+
+
+@functools.lru_cache(maxsize=None)
+def tracywidom_table(beta):
+    """Returns the grid x and the Tracy Widom cdf and pdf on it, as arrays.
+
+    The table is computed with TracyWidom once and then loaded from the cache
+    directory, since constructing TracyWidom and evaluating it point by point is
+    slow.
+    """
+    if beta not in _TW_MOMENTS:
+        raise ValueError(f"beta {beta} invalid, must be in {{1,2,4}}")
+
+    path = os.path.join(cache.cache_dir("stats"), f"tracywidom_beta{beta}.npz")
+    if os.path.exists(path):
+        with np.load(path) as table:
+            return table["x"], table["cdf"], table["pdf"]
+
+    x = np.linspace(*_TW_GRID)
+    tw = TracyWidom(beta=beta)
+    cdf = np.clip(tw.cdf(x), 0, 1)
+    pdf = np.clip(tw.pdf(x), 0, None)
+    cache.save_npz_atomic(path, x=x, cdf=cdf, pdf=pdf)
+    return x, cdf, pdf
 
-    # The Tracy Widom distributions need to be made mean 0 std 1 for the ks-test.
-    def tw1_cdf_adj(x):
-        return tw1.cdf(np.sqrt(1.607781034581) * x - 1.2065335745820)
 
-    def tw2_cdf_adj(x):
-        return tw2.cdf(np.sqrt(0.8131947928329) * x - 1.771086807411)
+def tracywidom_cdf(x, beta, standardized=False):
+    """Returns the Tracy Widom cdf at x, interpolated from tracywidom_table.
 
-    def tw4_cdf_adj(x):
-        return tw4.cdf(np.sqrt(0.5177237207726) * x - 2.306884893241)
+    Args:
+        x (float or np.ndarray): The points to evaluate at.
+        beta (int): One of 1, 2 or 4.
+        standardized (bool): If True, the distribution is shifted and scaled to
+            mean 0 and std 1.
+    """
+    grid, cdf, _ = tracywidom_table(beta)
+    if standardized:
+        mean, var = _TW_MOMENTS[beta]
+        x = np.sqrt(var) * np.asarray(x) + mean
+    return np.interp(x, grid, cdf)
 
+
+def tracywidom_pdf(x, beta, standardized=False):
+    """Returns the Tracy Widom pdf at x, interpolated from tracywidom_table. See
+    tracywidom_cdf."""
+    grid, _, pdf = tracywidom_table(beta)
+    if standardized:
+        mean, var = _TW_MOMENTS[beta]
+        return np.sqrt(var) * np.interp(np.sqrt(var) * np.asarray(x) + mean, grid, pdf)
+    return np.interp(x, grid, pdf)
+
+
+def _ks_statistics(sorted_x):
+    """Returns the KS statistics of sorted, standardized samples against the
+    standardized Tracy Widom distributions and the normal distribution."""
+    n = len(sorted_x)
+    upper = np.arange(1, n + 1) / n
+    lower = np.arange(n) / n
+
+    cdfs = {
+        f"tw{beta}": tracywidom_cdf(sorted_x, beta, standardized=True)
+        for beta in (1, 2, 4)
+    }
+    cdfs["normal"] = special.ndtr(sorted_x)
     return {
-        "tw1": stats.kstest(normed_list, tw1_cdf_adj).statistic,
-        "tw2": stats.kstest(normed_list, tw2_cdf_adj).statistic,
-        "tw4": stats.kstest(normed_list, tw4_cdf_adj).statistic,
-        "normal": stats.kstest(normed_list, stats.norm.cdf).statistic,
+        name: max(np.max(upper - cdf), np.max(cdf - lower))
+        for name, cdf in cdfs.items()
     }
+
+
+def _standardize(x):
+    return (x - np.mean(x)) / np.std(x)
+
+
+def tracywidom_ks_test(x):
+    """For an array x, returns the Kolmogorov-Smirnov-test for x normalized"""
+    return _ks_statistics(np.sort(_standardize(np.asarray(x, dtype=float))))
+
+
+def _bootstrap_chunk(x, num_resamples, seed):
+    rng = np.random.default_rng(seed)
+    results = []
+    for _ in range(num_resamples):
+        resample = x[rng.integers(0, len(x), size=len(x))]
+        results.append(_ks_statistics(np.sort(_standardize(resample))))
+    return results
+
+
+def bootstrap_ks_test(x, *, num_resamples=1000, confidence=0.95, num_cpus=1, seed=None):
+    """Returns the KS statistics of tracywidom_ks_test together with percentile
+    bootstrap confidence intervals.
+
+    Args:
+        x (np.ndarray): The samples.
+        num_resamples (int): The number of bootstrap resamples.
+        confidence (float): The coverage of the confidence intervals.
+        num_cpus (int): The number of processes the resamples are split over.
+        seed (int or None): The root seed of the resamples.
+
+    Returns:
+        dict: For each of 'tw1', 'tw2', 'tw4' and 'normal', a dict with the
+            'statistic' of x and the 'low' and 'high' ends of its interval.
+    """
+    x = np.asarray(x, dtype=float)
+    seeds = np.random.SeedSequence(seed).spawn(num_cpus)
+    sizes = [len(chunk) for chunk in np.array_split(np.arange(num_resamples), num_cpus)]
+
+    if num_cpus == 1:
+        resamples = _bootstrap_chunk(x, sizes[0], seeds[0])
+    else:
+        with multiprocessing.Pool(num_cpus) as pool:
+            chunks = pool.starmap(
+                _bootstrap_chunk, [(x, size, s) for size, s in zip(sizes, seeds)]
+            )
+        resamples = [result for chunk in chunks for result in chunk]
+
+    alpha = (1 - confidence) / 2
+    output = {}
+    for name, statistic in tracywidom_ks_test(x).items():
+        values = [result[name] for result in resamples]
+        low, high = np.quantile(values, [alpha, 1 - alpha])
+        output[name] = {"statistic": statistic, "low": low, "high": high}
+    return output
+
+
+def tracywidom_ks_tests(datasets):
+    """Returns tracywidom_ks_test of many datasets at once.
+
+    Args:
+        datasets (dict or iterable): A dict of name to array, or an iterable of .npy
+            file paths, e.g. every file in data/. Files are memory-mapped, so only
+            the sorted copy of one dataset is in memory at a time.
+
+    Returns:
+        dict: The tracywidom_ks_test result of each dataset, by name or path.
+    """
+    if not isinstance(datasets, dict):
+        datasets = {path: np.load(path, mmap_mode="r") for path in datasets}
+    return {name: tracywidom_ks_test(x) for name, x in datasets.items()}
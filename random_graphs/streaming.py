@@ -0,0 +1,220 @@
+import numpy as np
+from scipy import special
+from . import stats
+from .seeding import as_generator
+
+
+def _normal_quantile(confidence):
+    """Returns z such that a normal variable is within z std of its mean with
+    probability confidence."""
+    return special.ndtri((1 + confidence) / 2)
+
+
+class RunningMoments:
+    """Mean, variance and fourth central moment of a stream of values.
+
+    Batches are combined with the pairwise update formulas of Welford, Chan and
+    Pebay, which are numerically stable and let accumulators from different workers
+    be merged.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._m3 = 0.0
+        self._m4 = 0.0
+
+    def update(self, x):
+        """Adds the values of x to the stream."""
+        x = np.ravel(np.asarray(x, dtype=float))
+        if len(x) == 0:
+            return
+        batch = RunningMoments()
+        batch.count = len(x)
+        batch.mean = float(np.mean(x))
+        deviation = x - batch.mean
+        batch._m2 = float(np.sum(deviation**2))
+        batch._m3 = float(np.sum(deviation**3))
+        batch._m4 = float(np.sum(deviation**4))
+        self.merge(batch)
+
+    def merge(self, other):
+        """Adds the values summarized by another RunningMoments to the stream."""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean = other.count, other.mean
+            self._m2, self._m3, self._m4 = other._m2, other._m3, other._m4
+            return
+
+        na, nb = self.count, other.count
+        n = na + nb
+        delta = other.mean - self.mean
+
+        m2 = self._m2 + other._m2 + delta**2 * na * nb / n
+        m3 = (
+            self._m3
+            + other._m3
+            + delta**3 * na * nb * (na - nb) / n**2
+            + 3 * delta * (na * other._m2 - nb * self._m2) / n
+        )
+        m4 = (
+            self._m4
+            + other._m4
+            + delta**4 * na * nb * (na**2 - na * nb + nb**2) / n**3
+            + 6 * delta**2 * (na**2 * other._m2 + nb**2 * self._m2) / n**2
+            + 4 * delta * (na * other._m3 - nb * self._m3) / n
+        )
+
+        self.count = n
+        self.mean += delta * nb / n
+        self._m2, self._m3, self._m4 = m2, m3, m4
+
+    @property
+    def variance(self):
+        return self._m2 / self.count if self.count > 0 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def mean_ci_halfwidth(self, confidence=0.95):
+        """Returns the half width of the normal confidence interval of the mean, or
+        nan with fewer than 2 values."""
+        if self.count < 2:
+            return np.nan
+        return _normal_quantile(confidence) * self.std / np.sqrt(self.count)
+
+    def std_ci_halfwidth(self, confidence=0.95):
+        """Returns the half width of the confidence interval of the std.
+
+        The variance of the sample variance is (m4 - var^2)/n, which is mapped to the
+        std by the delta method. This accounts for the heavy tails of the data,
+        unlike the normal theory interval. Returns nan with fewer than 2 values, or
+        if they are all equal.
+        """
+        if self.count < 2 or self._m2 == 0:
+            return np.nan
+        var = self.variance
+        m4 = self._m4 / self.count
+        var_of_var = max(m4 - var**2, 0) / self.count
+        return _normal_quantile(confidence) * np.sqrt(var_of_var) / (2 * self.std)
+
+
+class Reservoir:
+    """A uniform random sample of fixed size from a stream of values.
+
+    Quantiles and KS distances estimated from the reservoir are accurate to about
+    1/sqrt(size), whatever the length of the stream.
+
+    Args:
+        size (int): The number of values kept.
+        rng (np.random.Generator, int or None): The random number generator.
+    """
+
+    def __init__(self, size=100000, rng=None):
+        self.size = size
+        self.count = 0
+        self.values = np.empty(size)
+        self._rng = as_generator(rng)
+
+    def update(self, x):
+        """Adds the values of x to the stream."""
+        x = np.ravel(np.asarray(x, dtype=float))
+
+        # Fill the reservoir first
+        fill = min(len(x), max(self.size - self.count, 0))
+        self.values[self.count : self.count + fill] = x[:fill]
+        self.count += fill
+        x = x[fill:]
+        if len(x) == 0:
+            return
+
+        # The value at stream position t replaces a random slot with probability
+        # size/(t + 1), as in Algorithm R
+        positions = self.count + np.arange(len(x))
+        slots = np.floor(self._rng.random(len(x)) * (positions + 1)).astype(np.int64)
+        keep = slots < self.size
+        # Later values must win when two land in the same slot, as in the
+        # sequential algorithm, and fancy assignment keeps the last one
+        self.values[slots[keep]] = x[keep]
+        self.count += len(x)
+
+    @property
+    def sample(self):
+        return self.values[: min(self.count, self.size)]
+
+    def quantiles(self, q):
+        return np.quantile(self.sample, q)
+
+
+class StreamingSummary:
+    """Running statistics of the results of an experiment, fed as they arrive.
+
+    Tracks exact moments with RunningMoments, and quantiles and KS distances to the
+    Tracy Widom and normal distributions through a Reservoir.
+
+    Args:
+        reservoir_size (int): The size of the reservoir.
+        rng (np.random.Generator, int or None): The random number generator of the
+            reservoir.
+    """
+
+    QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+    def __init__(self, reservoir_size=100000, rng=None):
+        self.moments = RunningMoments()
+        self.reservoir = Reservoir(reservoir_size, rng=rng)
+
+    def update(self, x):
+        self.moments.update(x)
+        self.reservoir.update(x)
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    def ci_width(self, target="mean", confidence=0.95):
+        """Returns the full width of the confidence interval of the mean or std."""
+        if self.count < 2:
+            return np.inf
+        if target == "mean":
+            return 2 * self.moments.mean_ci_halfwidth(confidence)
+        if target == "std":
+            return 2 * self.moments.std_ci_halfwidth(confidence)
+        raise ValueError(f"target '{target}' is invalid. Must be one of 'mean', 'std'")
+
+    def summary(self, confidence=0.95, std_scale=None):
+        """Returns the current statistics as a json serializable dict.
+
+        Args:
+            confidence (float): The coverage of the confidence intervals.
+            std_scale (float or None): If given, also report the std multiplied by
+                it, e.g. N**(2/3) to compare with stats.expected_std_scaling.
+                Without values, only the count and confidence are reported.
+        """
+        if self.count == 0:
+            return {"count": 0, "confidence": confidence}
+        output = {
+            "count": self.count,
+            "mean": self.moments.mean,
+            "mean_ci_halfwidth": self.moments.mean_ci_halfwidth(confidence),
+            "std": self.moments.std,
+            "std_ci_halfwidth": self.moments.std_ci_halfwidth(confidence),
+            "confidence": confidence,
+            "quantiles": dict(
+                zip(
+                    map(str, self.QUANTILES),
+                    self.reservoir.quantiles(self.QUANTILES).tolist(),
+                )
+            ),
+        }
+        if std_scale is not None:
+            output["scaled_std"] = self.moments.std * std_scale
+        if self.count > 1:
+            output["ks"] = stats.tracywidom_ks_test(self.reservoir.sample)
+        return {
+            key: (float(value) if isinstance(value, np.floating) else value)
+            for key, value in output.items()
+        }
@@ -1,30 +1,73 @@
 import os
 import argparse
 
-os.environ["MKL_NUM_THREADS"] = "1"
-os.environ["NUMEXPR_NUM_THREADS"] = "1"
-os.environ["OMP_NUM_THREADS"] = "1"
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+if threadpool_limits is None:
+    os.environ["MKL_NUM_THREADS"] = "1"
+    os.environ["NUMEXPR_NUM_THREADS"] = "1"
+    os.environ["OMP_NUM_THREADS"] = "1"
 # The above code was critical due to a bizarre issue with multiprocessing
 # that did not exist on my local machine, only the AWS and GCP CPUs.
 # Without this code, each process involving numpy or scipy eigenvalue
 # methods would consume all the CPUs available without any speedup.
+# With threadpoolctl, the runner limits the threads of each worker at runtime
+# instead, so workers of very large graphs can use more than one.
+import random_graphs  # noqa: E402
 import scripts.loop_graphs  # noqa: E402
 import scripts.cyclic_covers  # noqa: E402
 import scripts.quaternion_rep  # noqa: E402
 import scripts.complete_cover  # noqa: E402
 import scripts.irreg_cover  # noqa: E402
+import scripts.base_graph_cover  # noqa: E402
+import scripts.runner  # noqa: E402
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-f", "--script-name", type=str)
 parser.add_argument("-d", "--base_degree", type=int)
 parser.add_argument("-s", "--base-sizes", type=int, nargs="+")
 parser.add_argument("-cd", "--cover-degs", type=int, nargs="+")
+parser.add_argument("--base-graph", type=str)
 parser.add_argument("-n", "--number", type=int)
 parser.add_argument("-nc", "--number-covers", type=int)
 parser.add_argument("--simple", action=argparse.BooleanOptionalAction, default=True)
 parser.add_argument("-p", "--num_cpus", type=int)
+parser.add_argument("--seed", type=int)
+parser.add_argument("--resume", action="store_true")
+parser.add_argument("--shard-index", type=int, default=0)
+parser.add_argument("--num-shards", type=int, default=1)
+parser.add_argument(
+    "--precision", choices=["double", "single", "mixed"], default="double"
+)
+# Solve the graphs batch_size at a time with batched Lanczos, or by default as
+# many as fit in 64MB for the stacked dense solves of small covers
+parser.add_argument("--batch-size", type=int)
+# Keep covers as matrix-free operators (loop_graphs and quaternion_rep)
+parser.add_argument("--matrix-free", action="store_true")
+# Deflate the base graph eigenvectors instead of filtering out the base spectrum
+parser.add_argument("--deflate", action="store_true")
+parser.add_argument("--ci-width", type=float)
+parser.add_argument("--ci-target", choices=["mean", "std"], default="mean")
+parser.add_argument("--confidence", type=float, default=0.95)
+parser.add_argument("--min-samples", type=int, default=100)
+# BLAS threads per worker, or "auto" to choose them from the graph size
+parser.add_argument(
+    "--threads", type=lambda value: value if value == "auto" else int(value), default=1
+)
+# GB of memory all workers may use, 80% of the machine by default. Tasks
+# are admitted against their estimated, then measured, peak RSS
+parser.add_argument("--memory-budget", type=float)
 args = parser.parse_args()
 
+# Every shard must draw the samples of the same experiment
+if args.num_shards > 1 and args.seed is None:
+    parser.error("--num-shards needs an explicit --seed shared by all shards")
+if args.num_shards > 1 and args.ci_width is not None:
+    parser.error("--ci-width cannot be used with --num-shards")
+
 if args.num_cpus is None:
     import multiprocessing
 
@@ -32,57 +75,122 @@ if args.num_cpus is None:
 else:
     num_cpus = args.num_cpus
 
+if args.matrix_free and args.script_name not in ("loop_graphs", "quaternion_rep"):
+    parser.error("--matrix-free is only supported by loop_graphs and quaternion_rep")
+if args.matrix_free and args.batch_size is not None:
+    parser.error("--matrix-free cannot be used together with --batch-size")
+if args.deflate and args.script_name == "quaternion_rep":
+    parser.error("--deflate is not supported by quaternion_rep")
+
+if args.threads != 1 and threadpool_limits is None:
+    parser.error("--threads needs the threadpoolctl package")
+
 
 if __name__ == "__main__":
     deg = args.base_degree
 
-    if args.script_name == "loop_graphs":
-        for size in args.base_sizes:
-            scripts.loop_graphs.script_main(
-                size=size,
-                deg=args.base_degree,
-                number=args.number,
-                simple=args.simple,
-                num_cpus=num_cpus,
-            )
-    elif args.script_name == "cyclic_covers":
-        for size in args.base_sizes:
-            for cover_deg in args.cover_degs:
-                scripts.cyclic_covers.script_main(
+    # The parent and the workers it forks are single threaded until a chunk
+    # raises their limit
+    if threadpool_limits is not None:
+        threadpool_limits(limits=1)
+
+    # Calibrate the eigensolvers once, before the workers start
+    random_graphs.eigensolvers.solver_thresholds()
+
+    # One worker pool serves every size and cover degree of this invocation
+    with scripts.runner.Runner(
+        num_cpus,
+        resume=args.resume,
+        shard_index=args.shard_index,
+        num_shards=args.num_shards,
+        ci_width=args.ci_width,
+        ci_target=args.ci_target,
+        confidence=args.confidence,
+        min_samples=args.min_samples,
+        threads=args.threads,
+        memory_budget=(
+            None if args.memory_budget is None else int(args.memory_budget * 2**30)
+        ),
+    ) as runner:
+        if args.script_name == "loop_graphs":
+            for size in args.base_sizes:
+                scripts.loop_graphs.script_main(
+                    runner=runner,
                     size=size,
                     deg=args.base_degree,
-                    cover_deg=cover_deg,
                     number=args.number,
-                    number_covers=args.number_covers,
-                    num_cpus=num_cpus,
+                    simple=args.simple,
+                    precision=args.precision,
+                    batch_size=args.batch_size,
+                    matrix_free=args.matrix_free,
+                    deflate=args.deflate,
+                    seed=args.seed,
                 )
-    elif args.script_name == "quaternion_rep":
-        for size in args.base_sizes:
-            scripts.quaternion_rep.script_main(
-                size=size,
-                deg=args.base_degree,
-                number=args.number,
-                num_cpus=num_cpus,
-            )
-    elif args.script_name == "complete_cover":
-        for cover_deg in args.cover_degs:
+        elif args.script_name == "cyclic_covers":
+            for size in args.base_sizes:
+                for cover_deg in args.cover_degs:
+                    scripts.cyclic_covers.script_main(
+                        runner=runner,
+                        size=size,
+                        deg=args.base_degree,
+                        cover_deg=cover_deg,
+                        number=args.number,
+                        number_covers=args.number_covers,
+                        precision=args.precision,
+                        batch_size=args.batch_size,
+                        deflate=args.deflate,
+                        seed=args.seed,
+                    )
+        elif args.script_name == "quaternion_rep":
             for size in args.base_sizes:
-                scripts.complete_cover.script_main(
-                    base_size=size,
+                scripts.quaternion_rep.script_main(
+                    runner=runner,
+                    size=size,
+                    deg=args.base_degree,
+                    number=args.number,
+                    precision=args.precision,
+                    batch_size=args.batch_size,
+                    matrix_free=args.matrix_free,
+                    seed=args.seed,
+                )
+        elif args.script_name == "complete_cover":
+            for cover_deg in args.cover_degs:
+                for size in args.base_sizes:
+                    scripts.complete_cover.script_main(
+                        runner=runner,
+                        base_size=size,
+                        cover_deg=cover_deg,
+                        number=args.number,
+                        precision=args.precision,
+                        batch_size=args.batch_size,
+                        deflate=args.deflate,
+                        seed=args.seed,
+                    )
+        elif args.script_name == "irreg_cover":
+            for cover_deg in args.cover_degs:
+                scripts.irreg_cover.script_main(
+                    runner=runner,
                     cover_deg=cover_deg,
                     number=args.number,
-                    num_cpus=num_cpus,
+                    precision=args.precision,
+                    batch_size=args.batch_size,
+                    deflate=args.deflate,
+                    seed=args.seed,
                 )
-    elif args.script_name == "irreg_cover":
-        for cover_deg in args.cover_degs:
-            scripts.irreg_cover.script_main(
-                cover_deg=cover_deg,
+        elif args.script_name == "base_graph_cover":
+            scripts.base_graph_cover.script_main(
+                runner=runner,
+                path=args.base_graph,
+                cover_degs=args.cover_degs,
                 number=args.number,
-                num_cpus=num_cpus,
+                precision=args.precision,
+                batch_size=args.batch_size,
+                deflate=args.deflate,
+                seed=args.seed,
+            )
+        else:
+            raise ValueError(
+                "args.script_name must be one of "
+                "quaternion_rep, loop_graphs, cyclic_covers, "
+                "irreg_cover, k4_cover, base_graph_cover"
             )
-    else:
-        raise ValueError(
-            "args.script_name must be one of "
-            "quaternion_rep, loop_graphs, cyclic_covers, "
-            "irreg_cover, k4_cover"
-        )
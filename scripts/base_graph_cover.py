@@ -0,0 +1,99 @@
+import os
+import re
+
+import random_graphs
+import scipy.sparse
+from .runner import task_memory
+
+
+def sample_func(
+    entropy,
+    start_index,
+    stop_index,
+    *,
+    base_graph,
+    cover_deg,
+    trivial_eig,
+    precision,
+    batch_size=None,
+    deflate=False,
+):
+    rngs = [
+        random_graphs.seeding.sample_rng(entropy, i)
+        for i in range(start_index, stop_index)
+    ]
+
+    # The base graph is shared by the runner, not sent with every chunk
+    return random_graphs.generate_new_extremal_eigs(
+        **{
+            "base_graph": base_graph.attach(),
+            "cover_deg": cover_deg,
+            "permutation_func": random_graphs.permutations.uniform_permutation,
+            "number": stop_index - start_index,
+            "trivial_eig": trivial_eig,
+            "eig_type": "max_positive",
+            "deflate": deflate,
+            "batch_size": batch_size,
+            "precision": precision,
+            "rng": rngs,
+        }
+    )
+
+
+def script_main(
+    runner,
+    path,
+    cover_degs,
+    number,
+    precision="double",
+    batch_size=None,
+    deflate=False,
+    seed=None,
+):
+    """Runs random covers of each degree in cover_degs of the base graph saved with
+    scipy.sparse.save_npz at path.
+
+    The base graph is shared with the workers once for all the cover degrees. Its
+    spectrum goes through the on-disk cache of spectra.base_spectrum instead, as
+    it is at most 50 eigenvalues for graphs too large for the dense solver, and the
+    covers never need its eigenvectors: deflate projects out the functions that are
+    constant on fibers, which needs none.
+    """
+    base_graph = scipy.sparse.load_npz(path).tocsr()
+    trivial_eig = random_graphs.eigensolvers.extremal_eigs(
+        base_graph.astype(float), k=1, which="LA"
+    )[0]
+
+    # Computed once here, so the workers find it in the cache
+    random_graphs.spectra.cover_base_spectrum(base_graph)
+
+    name = re.sub(r"[^\w-]", "-", os.path.splitext(os.path.basename(path))[0])
+    suffix = "" if precision == "double" else f"_{precision}"
+    shared_base_graph = runner.share_csr(base_graph)
+    try:
+        for cover_deg in cover_degs:
+            filename = (
+                f"base_cover_{name}_V{base_graph.shape[0]}x{cover_deg}_N{number}"
+                f"{suffix}.npy"
+            )
+            runner.run(
+                sample_func,
+                filename=filename,
+                number=number,
+                seed=seed,
+                # Up to 5 eigenvalues of each cover are needed to skip the base ones
+                memory_per_task=task_memory(
+                    n=base_graph.shape[0] * cover_deg,
+                    nnz=base_graph.nnz * cover_deg,
+                    k=5,
+                    precision=precision,
+                ),
+                base_graph=shared_base_graph,
+                cover_deg=cover_deg,
+                trivial_eig=float(trivial_eig),
+                precision=precision,
+                batch_size=batch_size,
+                deflate=deflate,
+            )
+    finally:
+        runner.release(shared_base_graph)
@@ -0,0 +1,295 @@
+import glob
+import json
+import os
+import shutil
+
+import numpy as np
+
+from random_graphs import datasets, instrumentation
+
+
+def shard_range(number, shard_index, num_shards):
+    """Returns the (start, stop) range of the samples of shard shard_index when
+    number samples are split into num_shards contiguous, disjoint shards."""
+    return (number * shard_index) // num_shards, (
+        number * (shard_index + 1)
+    ) // num_shards
+
+
+def write_chunk(path, results):
+    """Saves the results of one chunk to path, atomically.
+
+    The array is written to a temporary file that is renamed into place, so a crash
+    never leaves a partial chunk under its final name.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.asarray(results))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ChunkStore:
+    """Append-only store for the results of one experiment, filled chunk by chunk.
+
+    The chunks of filename live in the directory filename[:-4] + ".chunks": one .npy
+    file per completed chunk of samples, and a manifest with one line per chunk
+    recording its sample range, file, root seed, shard and timing. A chunk file is
+    complete before its manifest line is appended, so after a crash every chunk in
+    the manifest can be trusted and only the samples missing from it need to be
+    rerun. Once all samples are done, merge writes them to filename.
+
+    An experiment split into shards, possibly run on different machines sharing the
+    directory, gives each shard its own manifest so no two processes append to the
+    same file. The number of samples and root seed shared by all shards are kept in
+    experiment.json.
+
+    Args:
+        filename (str): The .npy file the experiment is saved to.
+        shard_index (int): The shard written by this store.
+        num_shards (int): The number of shards of the experiment.
+    """
+
+    def __init__(self, filename, shard_index=0, num_shards=1):
+        self.filename = filename
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.directory = filename[:-4] + ".chunks"
+        if num_shards == 1:
+            manifest = "manifest.jsonl"
+        else:
+            manifest = f"manifest_shard{shard_index}of{num_shards}.jsonl"
+        self.manifest = os.path.join(self.directory, manifest)
+        self.experiment_file = os.path.join(self.directory, "experiment.json")
+
+    def exists(self):
+        return os.path.exists(self.directory)
+
+    def _read_manifest(self, manifest):
+        records = []
+        with open(manifest) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if os.path.exists(os.path.join(self.directory, record["file"])):
+                    records.append(record)
+        return records
+
+    def records(self, all_shards=False):
+        """Returns the manifest records whose chunk file exists, in sample order.
+
+        A line cut short by a crash is ignored.
+
+        Args:
+            all_shards (bool): If True, return the records of every shard instead of
+                only those of this one.
+        """
+        if all_shards:
+            manifests = glob.glob(os.path.join(self.directory, "manifest*.jsonl"))
+        elif os.path.exists(self.manifest):
+            manifests = [self.manifest]
+        else:
+            manifests = []
+        records = [
+            record
+            for manifest in sorted(manifests)
+            for record in self._read_manifest(manifest)
+        ]
+        return sorted(records, key=lambda record: record["start"])
+
+    def open(self, resume=False):
+        """Prepares the store for writing and returns the records already in it.
+
+        Args:
+            resume (bool): If True, keep the completed chunks of an earlier run.
+                Otherwise the earlier chunks of this shard are deleted.
+
+        Returns:
+            list of dict: The manifest records of the completed chunks.
+        """
+        if not resume and self.exists():
+            if self.num_shards == 1:
+                shutil.rmtree(self.directory)
+            else:
+                for record in self.records():
+                    os.remove(os.path.join(self.directory, record["file"]))
+                if os.path.exists(self.manifest):
+                    os.remove(self.manifest)
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Rewrite the manifest without broken lines so new records start on a
+        # fresh line
+        records = self.records()
+        tmp_path = self.manifest + ".tmp"
+        with open(tmp_path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self.manifest)
+        return records
+
+    def experiment(self):
+        """Returns the number of samples, root seed and metadata of the experiment
+        as a dict, or None if they have not been recorded yet."""
+        if not os.path.exists(self.experiment_file):
+            return None
+        with open(self.experiment_file) as f:
+            return json.load(f)
+
+    def set_experiment(self, number, seed, metadata=None):
+        """Records the number of samples and root seed of the experiment, and the
+        metadata to save alongside its results.
+
+        Raises:
+            ValueError: If the directory holds chunks of a different experiment.
+        """
+        experiment = {"number": number, "seed": seed, "metadata": metadata or {}}
+        recorded = self.experiment()
+        if recorded is not None:
+            if (recorded["number"], recorded["seed"]) != (number, seed):
+                raise ValueError(
+                    f"{self.directory} holds the chunks of {recorded['number']} "
+                    f"samples with seed {recorded['seed']}, not {number} with {seed}"
+                )
+            return
+        tmp_path = f"{self.experiment_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(experiment, f)
+        os.replace(tmp_path, self.experiment_file)
+
+    def chunk_file(self, start_index, stop_index):
+        """Returns the name of the chunk file of samples start_index to
+        stop_index - 1, relative to the store directory."""
+        return f"chunk_{start_index:010d}_{stop_index:010d}.npy"
+
+    def chunk_path(self, start_index, stop_index):
+        return os.path.join(self.directory, self.chunk_file(start_index, stop_index))
+
+    def append(self, record):
+        """Appends the record of a completed chunk to the manifest."""
+        with open(self.manifest, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def missing_ranges(self, start_index, stop_index, records):
+        """Returns the (start, stop) ranges of samples from start_index to
+        stop_index - 1 that are not covered by records."""
+        ranges = []
+        next_index = start_index
+        for record in records:
+            if record["start"] > next_index:
+                ranges.append((next_index, min(record["start"], stop_index)))
+            next_index = max(next_index, record["stop"])
+            if next_index >= stop_index:
+                break
+        if next_index < stop_index:
+            ranges.append((next_index, stop_index))
+        return [(start, stop) for start, stop in ranges if start < stop]
+
+    def merge(self, records, filename=None):
+        """Writes the chunks of records, in sample order, to filename, or to the
+        filename of the store if None.
+
+        The output is preallocated as a memory-mapped .npy file and filled one chunk
+        at a time, so memory use does not grow with the number of samples.
+        """
+        paths = [os.path.join(self.directory, record["file"]) for record in records]
+        shapes = [np.load(path, mmap_mode="r").shape for path in paths]
+        length = sum(shape[0] for shape in shapes)
+        if paths:
+            first = np.load(paths[0], mmap_mode="r")
+            dtype, row_shape = first.dtype, first.shape[1:]
+        else:
+            dtype, row_shape = np.float64, ()
+
+        if filename is None:
+            filename = self.filename
+        tmp_path = filename[:-4] + ".tmp.npy"
+        out = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=dtype, shape=(length,) + row_shape
+        )
+        position = 0
+        for path, shape in zip(paths, shapes):
+            out[position : position + shape[0]] = np.load(path)
+            position += shape[0]
+        out.flush()
+        del out
+        os.replace(tmp_path, filename)
+
+    def remove(self):
+        shutil.rmtree(self.directory)
+
+    def check_complete(self, records, number=None):
+        """Checks that records hold every sample of the experiment exactly once, all
+        run with its root seed. If number is given, only samples 0 to number - 1 are
+        expected.
+
+        Raises:
+            ValueError: If the experiment is unknown, a record has another seed, or
+                samples are missing or repeated.
+        """
+        experiment = self.experiment()
+        if experiment is None:
+            raise ValueError(f"{self.experiment_file} does not exist")
+        wrong_seed = [r["file"] for r in records if r["seed"] != experiment["seed"]]
+        if wrong_seed:
+            raise ValueError(f"Chunks {wrong_seed} were not run with the root seed")
+
+        next_index = 0
+        for record in records:
+            if record["start"] < next_index:
+                raise ValueError(f"Chunk {record['file']} repeats samples")
+            next_index = record["stop"]
+        if number is None:
+            number = experiment["number"]
+        missing = self.missing_ranges(0, number, records)
+        if missing:
+            raise ValueError(f"Samples {missing} of {self.filename} are missing")
+
+    def finish(self, number=None, filename=None, metadata=None):
+        """Merges the chunks of all shards into filename once they hold every
+        sample, saves the metadata of the experiment to its json sidecar (see
+        random_graphs.datasets), and deletes the chunks.
+
+        Args:
+            number (int or None): Only merge samples 0 to number - 1, for runs that
+                stopped early. All samples of the experiment if None.
+            filename (str or None): The file to merge to instead of the filename of
+                the store.
+            metadata (dict or None): Extra entries for the sidecar.
+        """
+        if filename is None:
+            filename = self.filename
+        experiment = self.experiment()
+        if number is None:
+            number = experiment["number"]
+        records = [
+            record
+            for record in self.records(all_shards=True)
+            if record["stop"] <= number
+        ]
+        self.check_complete(records, number)
+        self.merge(records, filename)
+
+        eigs = np.load(filename, mmap_mode="r")
+        metadata = {
+            **experiment["metadata"],
+            "number": number,
+            "seed": experiment["seed"],
+            "dtype": str(eigs.dtype),
+            "length": len(eigs),
+            "seconds": sum(record["seconds"] for record in records),
+            "instrumentation": instrumentation.merge(
+                record["instrumentation"] for record in records
+            ),
+            **(metadata or {}),
+            "chunks": [
+                {key: record[key] for key in ("start", "stop", "shard", "seconds")}
+                for record in records
+            ],
+        }
+        datasets.write_metadata(filename, metadata)
+        self.remove()
@@ -1,58 +1,76 @@
-import numpy as np
-import multiprocessing
-import time
 import random_graphs
-import os
+from .runner import task_memory
 
 
-def async_func(
+def sample_func(
+    entropy,
+    start_index,
+    stop_index,
+    *,
     base_size,
     cover_deg,
     deg,
-    inner_number,
+    number_covers,
+    precision,
+    batch_size=None,
+    deflate=False,
 ):
-    # Critical line of code so the results of multiprocessing are
-    # all identical
-    np.random.seed((os.getpid() * int(time.time())) % 123456789)
-
-    base_graph = random_graphs.random_simple_graph(size=base_size, deg=deg)
-    return random_graphs.generate_new_extremal_eigs(
-        **{
-            "base_graph": base_graph,
-            "cover_deg": cover_deg,
-            "permutation_func": random_graphs.permutations.abelian_cycle,
-            "number": inner_number,
-            "trivial_eig": deg,
-            "eig_type": "max_positive",
-        }
-    )
-
-
-def script_main(size, deg, cover_deg, number, number_covers, num_cpus):
-    start = time.time()
-    results = []
-
-    pool = multiprocessing.Pool(num_cpus)
+    eigs = []
+    for i in range(start_index, stop_index):
+        # Each base graph and its covers come from the Generator of sample i
+        rng = random_graphs.seeding.sample_rng(entropy, i)
 
-    for i in range(0, number):
-        result = pool.apply_async(
-            async_func,
-            kwds={
-                "base_size": size,
-                "cover_deg": cover_deg,
-                "deg": deg,
-                "inner_number": number_covers,
-            },
+        base_graph = random_graphs.random_simple_graph(size=base_size, deg=deg, rng=rng)
+        eigs.extend(
+            random_graphs.generate_new_extremal_eigs(
+                **{
+                    "base_graph": base_graph,
+                    "cover_deg": cover_deg,
+                    "permutation_func": random_graphs.permutations.abelian_cycle,
+                    "number": number_covers,
+                    "trivial_eig": deg,
+                    "eig_type": "max_positive",
+                    "deflate": deflate,
+                    "batch_size": batch_size,
+                    "precision": precision,
+                    "rng": rng,
+                }
+            )
         )
-        results.append(result)
+    return eigs
 
-    eigs = []
-    for x in results:
-        eigs.extend(x.get())
 
+def script_main(
+    runner,
+    size,
+    deg,
+    cover_deg,
+    number,
+    number_covers,
+    precision="double",
+    batch_size=None,
+    deflate=False,
+    seed=None,
+):
+    suffix = "" if precision == "double" else f"_{precision}"
     filename = (
-        f"abeliancover_V{size}x{cover_deg}_N{number}x{number_covers}_bdeg{deg}.npy"
+        f"abeliancover_V{size}x{cover_deg}_N{number}x{number_covers}_bdeg{deg}"
+        f"{suffix}.npy"
+    )
+    runner.run(
+        sample_func,
+        filename=filename,
+        number=number,
+        seed=seed,
+        # Up to 5 eigenvalues of each cover are needed to skip the base ones
+        memory_per_task=task_memory(
+            n=size * cover_deg, nnz=size * deg * cover_deg, k=5, precision=precision
+        ),
+        base_size=size,
+        cover_deg=cover_deg,
+        deg=deg,
+        number_covers=number_covers,
+        precision=precision,
+        batch_size=batch_size,
+        deflate=deflate,
     )
-
-    np.save(filename, np.array(eigs))
-    print(f"Filename {filename} time: {np.round(time.time() - start,2)}s")
@@ -1,45 +1,64 @@
-import numpy as np
-import multiprocessing
-import time
 import random_graphs
-import os
+from .runner import task_memory
 
 
-def async_func(size, deg, number, simple):
-    # Critical line of code so the results of multiprocessing are
-    # all identical
-    np.random.seed((os.getpid() * int(time.time())) % 123456789)
+def sample_func(
+    entropy,
+    start_index,
+    stop_index,
+    *,
+    size,
+    deg,
+    simple,
+    precision,
+    batch_size=None,
+    matrix_free=False,
+    deflate=False,
+):
+    rngs = [
+        random_graphs.seeding.sample_rng(entropy, i)
+        for i in range(start_index, stop_index)
+    ]
     return random_graphs.generate_loop_extremal_eigs(
-        size=size, deg=deg, number=number, eig_type="max_positive", simple=True
+        size=size,
+        deg=deg,
+        number=stop_index - start_index,
+        eig_type="max_positive",
+        simple=simple,
+        matrix_free=matrix_free,
+        batch_size=batch_size,
+        deflate=deflate,
+        precision=precision,
+        rng=rngs,
     )
 
 
-def script_main(size, deg, number, simple, num_cpus):
-    start = time.time()
-    results = []
-
-    pool = multiprocessing.Pool(num_cpus)
-
-    if number > 10 * num_cpus:
-        nbatches = num_cpus * 10
-        batch_size = int(number / nbatches)
-        remaining = number - nbatches * batch_size
-        inner_numbers = [batch_size] * nbatches + [remaining]
-    else:
-        inner_numbers = [1] * number
-
-    for inner_number in inner_numbers:
-        result = pool.apply_async(
-            async_func,
-            kwds={"size": size, "deg": deg, "number": inner_number, "simple": simple},
-        )
-        results.append(result)
-
-    eigs = []
-    for x in results:
-        eigs.extend(x.get())
-
+def script_main(
+    runner,
+    size,
+    deg,
+    number,
+    simple,
+    precision="double",
+    batch_size=None,
+    matrix_free=False,
+    deflate=False,
+    seed=None,
+):
     file_prefix = "simple" if simple else "loop_cover"
-    filename = file_prefix + f"_deg{deg}_V{size}_N{number}.npy"
-    np.save(filename, np.array(eigs))
-    print(f"Filename {filename} time: {np.round(time.time() - start,2)}s")
+    suffix = "" if precision == "double" else f"_{precision}"
+    filename = file_prefix + f"_deg{deg}_V{size}_N{number}{suffix}.npy"
+    runner.run(
+        sample_func,
+        filename=filename,
+        number=number,
+        seed=seed,
+        memory_per_task=task_memory(n=size, nnz=size * deg, precision=precision),
+        size=size,
+        deg=deg,
+        simple=simple,
+        precision=precision,
+        batch_size=batch_size,
+        matrix_free=matrix_free,
+        deflate=deflate,
+    )
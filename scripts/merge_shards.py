@@ -0,0 +1,58 @@
+"""Merges the shards of experiments run with run.py --num-shards into their final
+.npy files.
+
+Usage:
+    python -m scripts.merge_shards simple_deg4_V1000_N5000000.npy [...]
+
+Each argument is the final .npy file of an experiment, or its .chunks directory.
+The chunks of every shard are checked to hold each sample exactly once, all run
+with the same root seed, before they are merged and deleted.
+"""
+
+import argparse
+
+from .chunk_store import ChunkStore
+
+
+def _filename(path):
+    path = path.rstrip("/")
+    if path.endswith(".chunks"):
+        return path[: -len(".chunks")] + ".npy"
+    return path
+
+
+def merge_shards(filename):
+    """Validates and merges the shards of the experiment saved to filename.
+
+    Raises:
+        ValueError: If the chunk store has no experiment file, e.g. because no shard
+            has started, or its chunks do not cover the experiment.
+    """
+    store = ChunkStore(filename)
+    experiment = store.experiment()
+    if experiment is None:
+        raise ValueError(
+            f"{store.directory} has no experiment file. Were the shards of "
+            f"{filename} run with run.py --num-shards?"
+        )
+    records = store.records(all_shards=True)
+    shards = sorted({record["shard"] for record in records})
+    print(
+        f"Filename {filename}: {len(records)} chunks from shards {shards}, "
+        f"{sum(record['stop'] - record['start'] for record in records)} of "
+        f"{experiment['number']} samples"
+    )
+    store.finish()
+    print(f"Filename {filename} seed: {experiment['seed']} merged")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", type=str, nargs="+")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        try:
+            merge_shards(_filename(path))
+        except ValueError as error:
+            parser.exit(1, f"{error}\n")
@@ -1,48 +1,59 @@
-import numpy as np
-import multiprocessing
-import time
 import random_graphs
-import os
-
-
-def async_func(size, deg, number):
-    # Critical line of code so the results of multiprocessing are
-    # all identical
-    np.random.seed((os.getpid() * int(time.time())) % 123456789)
+from .runner import task_memory
+
+
+def sample_func(
+    entropy,
+    start_index,
+    stop_index,
+    *,
+    size,
+    deg,
+    precision,
+    batch_size=None,
+    matrix_free=False,
+):
+    rngs = [
+        random_graphs.seeding.sample_rng(entropy, i)
+        for i in range(start_index, stop_index)
+    ]
     return random_graphs.generate_matrix_rep_eigs(
         size=size,
         deg=deg,
-        number=number,
+        number=stop_index - start_index,
         eig_type="max_positive",
         matrix_func=random_graphs.quaternion_matrix_rep,
+        batch_size=batch_size,
+        matrix_free=matrix_free,
+        precision=precision,
+        rng=rngs,
     )
 
 
-def script_main(size, deg, number, num_cpus):
-    start = time.time()
-    results = []
-
-    pool = multiprocessing.Pool(num_cpus)
-
-    if number > 10 * num_cpus:
-        nbatches = num_cpus * 10
-        batch_size = int(number / nbatches)
-        remaining = number - nbatches * batch_size
-        inner_numbers = [batch_size] * nbatches + [remaining]
-    else:
-        inner_numbers = [1] * number
-
-    for inner_number in inner_numbers:
-        result = pool.apply_async(
-            async_func,
-            kwds={"size": size, "deg": deg, "number": inner_number},
-        )
-        results.append(result)
-
-    eigs = []
-    for x in results:
-        eigs.extend(x.get())
-
-    filename = f"quaternion_deg{deg}_V{size}x4_N{number}.npy"
-    np.save(filename, np.array(eigs))
-    print(f"Filename {filename} time: {np.round(time.time() - start,2)}s")
+def script_main(
+    runner,
+    size,
+    deg,
+    number,
+    precision="double",
+    batch_size=None,
+    matrix_free=False,
+    seed=None,
+):
+    suffix = "" if precision == "double" else f"_{precision}"
+    filename = f"quaternion_deg{deg}_V{size}x4_N{number}{suffix}.npy"
+    runner.run(
+        sample_func,
+        filename=filename,
+        number=number,
+        seed=seed,
+        # The quaternion matrix has a 4 x 4 block for every entry
+        memory_per_task=task_memory(
+            n=4 * size, nnz=16 * size * deg, precision=precision
+        ),
+        size=size,
+        deg=deg,
+        precision=precision,
+        batch_size=batch_size,
+        matrix_free=matrix_free,
+    )
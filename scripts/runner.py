@@ -0,0 +1,600 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import re
+import resource
+import sys
+import time
+
+import numpy as np
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+from random_graphs import datasets, eigensolvers, instrumentation, seeding, streaming
+from .chunk_store import ChunkStore, shard_range, write_chunk
+from .shared_arrays import SharedArrays
+
+# Parameters that only change how the samples are solved, not which graphs are
+# drawn, so runs that differ in them share their samples
+_SOLVER_PARAMS = ("precision", "batch_size", "matrix_free", "deflate")
+
+# The memory of a worker before it builds any graph: the interpreter, numpy, scipy
+# and the modules of random_graphs
+_WORKER_BASE_MEMORY = 100 * 2**20
+
+
+def task_memory(*, n, nnz, k=2, precision="double", solver=None):
+    """Returns an estimate in bytes of the peak memory of a sample that solves for k
+    extremal eigenvalues of an n x n sparse matrix with nnz stored entries.
+
+    Counts the COO triplets the matrix is built from and the float64 CSR matrix,
+    plus its float32 copy for the single and mixed precision tiers, and the working
+    memory of the solver: the dense matrix and eigh workspace, ARPACK's ncv Lanczos
+    vectors, or the blocks of lobpcg, in the dtype of the precision tier. It is
+    meant to plan how many workers fit in memory, not to be exact, and the runner
+    replaces it by the measured peak RSS once chunks complete.
+
+    Args:
+        n (int): The size of the matrix.
+        nnz (int): The number of stored entries.
+        k (int): The number of eigenvalues solved for.
+        precision (str): The precision tier of the solve, one of
+            eigensolvers.PRECISIONS.
+        solver (str or None): 'dense', 'eigsh' or 'lobpcg'. None uses the solver
+            eigensolvers.choose_solver picks.
+
+    Returns:
+        int: The estimated peak memory.
+    """
+    itemsize = 8 if precision == "double" else 4
+    if solver is None:
+        solver = eigensolvers.choose_solver(n=n, nnz=nnz, k=k)
+
+    # The row, column and value arrays of the COO triplets, then the CSR matrix
+    matrix = nnz * (8 + 8 + 8) + nnz * (4 + 8) + 8 * (n + 1)
+    if precision != "double":
+        matrix += nnz * (4 + 4)
+
+    if solver == "dense":
+        # The dense matrix, and the copy and workspace of eigh
+        solve = 3 * n * n * itemsize
+    elif solver == "lobpcg":
+        # The blocks X, AX, the residuals, the search directions and their
+        # products with A, and the basis of the Rayleigh Ritz step
+        solve = 9 * k * n * itemsize
+    else:
+        # The ncv Lanczos vectors ARPACK keeps by default, and its work vectors
+        ncv = min(n, max(2 * k + 1, 20))
+        solve = (ncv + 3) * n * itemsize
+
+    # The starting vector, permutations and other length n arrays of the sample
+    return _WORKER_BASE_MEMORY + matrix + solve + 8 * 8 * n
+
+
+def physical_memory():
+    """Returns the physical memory of the machine in bytes."""
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def _reset_peak_rss():
+    """Resets the peak RSS of this process to its current RSS, so the next
+    _peak_rss covers one chunk. Needs Linux, elsewhere the peak is over the life of
+    the process."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss():
+    """Returns the peak resident memory of this process in bytes."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _thread_limits(threads):
+    """Returns a context manager limiting the BLAS and OpenMP thread pools of this
+    process to threads."""
+    if threadpool_limits is None:
+        return contextlib.nullcontext()
+    return threadpool_limits(limits=threads)
+
+
+def _run_chunk(sample_func, entropy, start_index, stop_index, params, path, threads):
+    """Runs sample_func on one chunk inside a worker with threads BLAS threads, saves
+    the results to path and times it. Also returns the instrumentation snapshot of
+    the chunk, with the peak RSS of the worker during the chunk as the maximum
+    peak_rss_mb."""
+    instrumentation.reset()
+    _reset_peak_rss()
+    chunk_start = time.perf_counter()
+    with _thread_limits(threads):
+        results = sample_func(entropy, start_index, stop_index, **params)
+    write_chunk(path, results)
+    elapsed = time.perf_counter() - chunk_start
+    instrumentation.maximum("peak_rss_mb", _peak_rss() / 2**20)
+    return start_index, stop_index, elapsed, instrumentation.snapshot()
+
+
+def _stopped_filename(filename, planned_number, number):
+    """Returns filename with the number of samples of an early stopped run in place
+    of the planned number, e.g. simple_deg3_V100_N1000.npy to ..._N240.npy."""
+    return re.sub(rf"_N{planned_number}(?!\d)", f"_N{number}", filename, count=1)
+
+
+def _stopped_marker(filename):
+    """Returns the file that points from the planned filename of an early stopped
+    run to the file it was saved as."""
+    return filename[:-4] + ".stopped.json"
+
+
+def _completed_filename(filename):
+    """Returns the file the experiment planned as filename was saved to, which is
+    filename itself or the file of an early stopped run, or None if it is not
+    complete."""
+    if os.path.exists(filename):
+        return filename
+    marker = _stopped_marker(filename)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            stopped = os.path.join(os.path.dirname(filename), json.load(f)["filename"])
+        if os.path.exists(stopped):
+            return stopped
+    return None
+
+
+def _format_summary(summary):
+    """Returns the main statistics of a StreamingSummary.summary as one line."""
+    if summary["count"] == 0:
+        return "Values: 0"
+    line = (
+        f"Values: {summary['count']} "
+        f"mean: {summary['mean']:.6g} +- {summary['mean_ci_halfwidth']:.2g} "
+        f"std: {summary['std']:.6g} +- {summary['std_ci_halfwidth']:.2g}"
+    )
+    if "ks" in summary:
+        line += " ks: " + " ".join(
+            f"{name}={value:.4f}" for name, value in summary["ks"].items()
+        )
+    return line
+
+
+class Runner:
+    """A single worker pool that every experiment of a run.py invocation plugs into.
+
+    An experiment is a sample function called as
+    sample_func(entropy, start_index, stop_index, **params), which returns the list
+    of results for samples start_index to stop_index - 1. Sample i must draw all of
+    its randomness from random_graphs.seeding.sample_rng(entropy, i), so the results
+    do not depend on how the samples are split into chunks.
+
+    Chunks are handed out dynamically. The first ones hold a single sample, then the
+    chunk size is set from the measured time per sample so each chunk takes about
+    target_chunk_seconds. It is capped by the remaining samples divided by twice the
+    number of workers, so the last chunks are small and all workers finish together.
+
+    Each worker saves its chunk to the ChunkStore of the experiment and the parent
+    only appends a manifest line, so the parent's memory stays flat however many
+    samples there are. The chunks are merged into the final .npy file at the end.
+    With resume, the chunks completed by an earlier, interrupted run are kept and
+    only the missing samples are run. Each chunk also records the
+    random_graphs.instrumentation totals of its worker, and the totals of the whole
+    experiment are printed at the end.
+
+    With num_shards > 1, the runner only runs the contiguous slice of samples of
+    shard shard_index, so one experiment can be split across machines that share
+    the output directory. Every shard must be given the same root seed. The chunks
+    are left in place for scripts/merge_shards.py once all shards are done.
+
+    The parent feeds each completed chunk to a random_graphs.streaming
+    StreamingSummary, whose mean, std, quantiles and Tracy Widom KS distances are
+    printed and saved to the sidecar. With ci_width, the runner stops handing out
+    chunks once the confidence interval of the mean or std of the results is that
+    narrow, and number only caps the run. The chunks already running are finished,
+    and the longest complete prefix of samples is saved, with its number of samples
+    in place of number in the filename. A marker next to the planned filename
+    points to it, so resuming a sweep skips the experiments that stopped early.
+
+    Large inputs shared by all chunks, like a base graph with millions of
+    vertices, are passed to share or share_csr once. The returned handles are
+    passed as params instead of the arrays, so only a file path is sent with each
+    chunk, and sample functions call handle.attach() to get read-only views of one
+    copy of the arrays in shared memory. The shared arrays are deleted by release,
+    or when the runner is closed.
+
+    Each experiment runs on a plan of processes x threads per process. By default
+    every cpu runs its own single threaded worker, which suits graphs of up to about
+    V=20,000. For much larger graphs, run is given the memory_per_task of one sample,
+    e.g. from task_memory, and only as many chunks as fit in memory_budget are
+    admitted at once. Every chunk reports the peak RSS of its worker, and from the
+    first completed chunk on, the largest peak so far replaces the estimate, so the
+    concurrency follows the memory the samples really use. Peak RSS counts the
+    pages a worker shares with the parent and the shared arrays, so it errs on the
+    safe side. With threads="auto", the cpus left idle are split between the
+    running workers as BLAS and OpenMP threads, set with threadpoolctl around each
+    chunk, so dense and block solves use them. An integer threads fixes the threads
+    per worker, and the number of processes is num_cpus // threads, or fewer if
+    memory is short.
+
+    Args:
+        num_cpus (int): The number of worker processes, and cpus to plan for.
+        target_chunk_seconds (float): The wall time each chunk should take.
+        resume (bool): If True, continue interrupted experiments instead of starting
+            them over.
+        shard_index (int): The shard of every experiment run by this runner.
+        num_shards (int): The number of shards every experiment is split into.
+        ci_width (float or None): Stop once the confidence interval is narrower than
+            this. None runs all samples.
+        ci_target (str): 'mean' or 'std', the statistic ci_width applies to.
+        confidence (float): The coverage of the confidence intervals.
+        min_samples (int): The number of samples to run before stopping early.
+        threads (int or str): The threads per worker, or 'auto' to choose them for
+            each experiment from memory_per_task.
+        memory_budget (int or None): The memory in bytes all workers may use,
+            idle or running. None uses 80% of the physical memory.
+    """
+
+    def __init__(
+        self,
+        num_cpus,
+        target_chunk_seconds=5.0,
+        resume=False,
+        shard_index=0,
+        num_shards=1,
+        ci_width=None,
+        ci_target="mean",
+        confidence=0.95,
+        min_samples=100,
+        threads=1,
+        memory_budget=None,
+    ):
+        if not 0 <= shard_index < num_shards:
+            raise ValueError(f"shard_index {shard_index} is not in [0, {num_shards})")
+        if ci_width is not None and num_shards > 1:
+            # A shard only sees its own results, so cannot tell when to stop
+            raise ValueError("ci_width is not supported with num_shards > 1")
+        if ci_target not in ("mean", "std"):
+            raise ValueError(
+                f"ci_target '{ci_target}' is invalid. Must be one of 'mean', 'std'"
+            )
+        self.num_cpus = num_cpus
+        self.target_chunk_seconds = target_chunk_seconds
+        self.resume = resume
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.ci_width = ci_width
+        self.ci_target = ci_target
+        self.confidence = confidence
+        if threads != "auto" and not 1 <= threads <= num_cpus:
+            raise ValueError(f"threads {threads} is not 'auto' or in [1, {num_cpus}]")
+        if threads != 1 and threadpool_limits is None:
+            raise ImportError("threads other than 1 need the threadpoolctl package")
+        self.min_samples = min_samples
+        self.threads = threads
+        if memory_budget is None:
+            memory_budget = int(0.8 * physical_memory())
+        self.memory_budget = memory_budget
+        self.pool = multiprocessing.Pool(num_cpus)
+        self._shared = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.pool.terminate()
+            self.pool.join()
+            self._close_shared()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self._close_shared()
+
+    def _close_shared(self):
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+    def share(self, array):
+        """Returns a scripts.shared_arrays.SharedArray handle to a copy of array
+        that every worker can attach to."""
+        if self._shared is None:
+            self._shared = SharedArrays()
+        return self._shared.share(array)
+
+    def share_csr(self, matrix):
+        """Returns a scripts.shared_arrays.SharedCSR handle to a copy of the sparse
+        matrix that every worker can attach to."""
+        if self._shared is None:
+            self._shared = SharedArrays()
+        return self._shared.share_csr(matrix)
+
+    def release(self, handle):
+        """Deletes the shared copy behind a handle returned by share or share_csr,
+        once no more chunks will attach to it."""
+        if self._shared is not None:
+            self._shared.release(handle)
+
+    def plan(self, memory_per_task=None):
+        """Returns the number of processes and threads per process to run an
+        experiment whose samples each need memory_per_task bytes.
+
+        All num_cpus processes of the pool stay alive whatever the plan, so the
+        budget first pays for the base memory of every worker, and each running
+        chunk then needs memory_per_task less that base on top.
+
+        Args:
+            memory_per_task (int or None): The peak memory of one sample, e.g. from
+                task_memory. None does not limit the processes by memory.
+
+        Returns:
+            (int, int): The number of chunks run at once, and the BLAS threads of
+                each.
+        """
+        max_processes = self.num_cpus
+        if memory_per_task is not None:
+            spare = self.memory_budget - self.num_cpus * _WORKER_BASE_MEMORY
+            extra = memory_per_task - _WORKER_BASE_MEMORY
+            if extra > 0:
+                max_processes = min(max_processes, max(1, int(spare // extra)))
+        if self.threads == "auto":
+            return max_processes, max(1, self.num_cpus // max_processes)
+        return min(max_processes, self.num_cpus // self.threads), self.threads
+
+    def _chunk_size(self, remaining, seconds_per_sample, processes):
+        if seconds_per_sample is None:
+            return 1
+        size = int(self.target_chunk_seconds / max(seconds_per_sample, 1e-9))
+        return max(1, min(size, remaining // (2 * processes)))
+
+    def _should_stop(self, summary, samples_done):
+        if self.ci_width is None or samples_done < self.min_samples:
+            return False
+        return summary.ci_width(self.ci_target, self.confidence) <= self.ci_width
+
+    def run(
+        self,
+        sample_func,
+        *,
+        filename,
+        number,
+        seed=None,
+        memory_per_task=None,
+        **params,
+    ):
+        """Runs samples 0 to number - 1 of an experiment and saves the results.
+
+        The results are saved in sample order to filename, and the parameters, root
+        seed, code version, chunk timings and streaming summary to its json sidecar.
+        A sharded runner only runs the samples of its shard and leaves them in the
+        chunk store.
+
+        Args:
+            sample_func (function): The sample function of the experiment. Must be
+                defined at the top level of a module so it can be sent to workers.
+            filename (str): The .npy file to save the results to.
+            number (int): The number of samples.
+            seed (int or None): The root seed, mixed with the script and params by
+                seeding.experiment_entropy so every experiment of a sweep draws
+                independent samples. None draws fresh entropy, or reuses the
+                entropy of the interrupted run when resuming.
+            memory_per_task (int or None): The estimated peak memory of one sample
+                in bytes, used by plan to choose the processes and threads until
+                chunks report their peak RSS. None does not limit the processes by
+                memory.
+            **params: Keyword arguments passed on to sample_func.
+
+        Returns:
+            np.ndarray or None: The results of all samples in sample order,
+                memory-mapped from the saved file, or None for a sharded runner.
+        """
+        start = time.time()
+        store = ChunkStore(filename, self.shard_index, self.num_shards)
+        if self.resume and not store.exists():
+            completed = _completed_filename(filename)
+            if completed is not None:
+                print(f"Filename {completed} is already complete")
+                return np.load(completed, mmap_mode="r")
+
+        records = store.open(resume=self.resume)
+        experiment = store.experiment()
+        described_params = {
+            key: value.describe() if hasattr(value, "describe") else value
+            for key, value in params.items()
+        }
+        if seed is None and experiment is not None and self.resume:
+            entropy = experiment["seed"]
+        else:
+            # The precision tiers and solver modes of one experiment draw the same
+            # samples, so they can be compared sample by sample
+            key = json.dumps(
+                {
+                    "script": sample_func.__module__,
+                    "params": {
+                        name: value
+                        for name, value in described_params.items()
+                        if name not in _SOLVER_PARAMS
+                    },
+                },
+                sort_keys=True,
+            )
+            entropy = seeding.experiment_entropy(seed, key)
+        experiment, _ = datasets.parse_filename(filename)
+        processes, threads = self.plan(memory_per_task)
+        if (processes, threads) != (self.num_cpus, 1):
+            print(f"Filename {filename} runs {processes} processes x {threads} threads")
+        store.set_experiment(
+            number,
+            entropy,
+            metadata={
+                "experiment": experiment,
+                "script": sample_func.__module__,
+                "root_seed": seed,
+                "params": {**described_params, "number": number},
+                "code_version": datasets.code_version(),
+                "workers": {"processes": processes, "threads": threads},
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            },
+        )
+
+        start_index, stop_index = shard_range(number, self.shard_index, self.num_shards)
+        pending = store.missing_ranges(start_index, stop_index, records)
+        done = queue.Queue()
+        in_flight = 0
+        samples_done = 0
+        worker_seconds = 0.0
+
+        # The chunks of an interrupted run count towards the summary
+        summary = streaming.StreamingSummary(rng=entropy)
+        for record in records:
+            summary.update(np.load(store.chunk_path(record["start"], record["stop"])))
+        samples_resumed = sum(record["stop"] - record["start"] for record in records)
+        stopped_early = self._should_stop(summary, samples_resumed)
+        if stopped_early:
+            pending = []
+
+        # Queueing a chunk per busy worker keeps them fed. When memory limits the
+        # processes, only that many chunks are admitted at once.
+        peak_rss = 0
+        while pending or in_flight > 0:
+            max_in_flight = 2 * processes if processes == self.num_cpus else processes
+            while pending and in_flight < max_in_flight:
+                seconds_per_sample = (
+                    worker_seconds / samples_done if samples_done > 0 else None
+                )
+                remaining = sum(stop - first for first, stop in pending)
+                size = self._chunk_size(remaining, seconds_per_sample, processes)
+                start_index, range_stop = pending[0]
+                stop_index = min(start_index + size, range_stop)
+                if stop_index == range_stop:
+                    pending.pop(0)
+                else:
+                    pending[0] = (stop_index, range_stop)
+
+                self.pool.apply_async(
+                    _run_chunk,
+                    (
+                        sample_func,
+                        entropy,
+                        start_index,
+                        stop_index,
+                        params,
+                        store.chunk_path(start_index, stop_index),
+                        threads,
+                    ),
+                    callback=done.put,
+                    error_callback=done.put,
+                )
+                in_flight += 1
+
+            result = done.get()
+            if isinstance(result, BaseException):
+                raise result
+            start_index, stop_index, elapsed, snapshot = result
+            store.append(
+                {
+                    "start": start_index,
+                    "stop": stop_index,
+                    "file": store.chunk_file(start_index, stop_index),
+                    "seed": entropy,
+                    "shard": self.shard_index,
+                    "seconds": elapsed,
+                    "instrumentation": snapshot,
+                }
+            )
+            in_flight -= 1
+            samples_done += stop_index - start_index
+            worker_seconds += elapsed
+            peak_rss = max(peak_rss, int(snapshot["maxima"]["peak_rss_mb"] * 2**20))
+            if memory_per_task is not None:
+                processes, threads = self.plan(peak_rss)
+
+            summary.update(np.load(store.chunk_path(start_index, stop_index)))
+            if not stopped_early and self._should_stop(
+                summary, samples_resumed + samples_done
+            ):
+                stopped_early = True
+                pending = []
+
+        totals = instrumentation.merge(
+            record["instrumentation"] for record in store.records()
+        )
+        if self.num_shards > 1:
+            print(
+                f"Filename {filename} shard {self.shard_index} of {self.num_shards} "
+                f"seed: {entropy} time: {np.round(time.time() - start,2)}s"
+            )
+            print(_format_summary(summary.summary(self.confidence)))
+            print(instrumentation.report(totals))
+            return None
+
+        metadata = {}
+        if stopped_early:
+            # Samples past a gap left by an interrupted run are dropped
+            planned_number, planned_filename = number, filename
+            missing = store.missing_ranges(0, number, store.records())
+            number = missing[0][0] if missing else number
+            filename = _stopped_filename(filename, planned_number, number)
+            summary = streaming.StreamingSummary(rng=entropy)
+            for record in store.records():
+                if record["stop"] <= number:
+                    summary.update(
+                        np.load(store.chunk_path(record["start"], record["stop"]))
+                    )
+            metadata["early_stopping"] = {
+                "ci_width": self.ci_width,
+                "ci_target": self.ci_target,
+                "confidence": self.confidence,
+                "planned_number": planned_number,
+            }
+            metadata["params"] = {
+                **store.experiment()["metadata"]["params"],
+                "number": number,
+            }
+        if memory_per_task is not None:
+            metadata["memory"] = {
+                "budget": self.memory_budget,
+                "estimated_per_task": memory_per_task,
+                "peak_rss_per_task": peak_rss,
+                "processes": processes,
+                "threads": threads,
+            }
+        metadata["summary"] = summary.summary(self.confidence)
+        if stopped_early:
+            # Written before the chunks are merged and deleted, so a resumed run
+            # finds either the chunks or the saved file
+            tmp_path = _stopped_marker(planned_filename) + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"filename": os.path.basename(filename)}, f)
+            os.replace(tmp_path, _stopped_marker(planned_filename))
+        store.finish(number=number, filename=filename, metadata=metadata)
+        print(
+            f"Filename {filename} seed: {entropy} "
+            f"time: {np.round(time.time() - start,2)}s"
+        )
+        print(_format_summary(metadata["summary"]))
+        if memory_per_task is not None:
+            print(
+                f"Memory per task: estimated {memory_per_task / 2**20:.0f}MB "
+                f"peak RSS {peak_rss / 2**20:.0f}MB, "
+                f"ran {processes} processes x {threads} threads"
+            )
+        print(instrumentation.report(totals))
+        return np.load(filename, mmap_mode="r")
@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from random_graphs import spectra
+
+# The arrays this process has opened, by path, so each worker maps a file once
+# however many chunks use it.
+_attached = {}
+
+
+def _evict_released():
+    # The parent deletes the files of released handles, and dropping the maps of a
+    # deleted file is what frees its pages
+    for key in list(_attached):
+        path = key[0] if isinstance(key, tuple) else key
+        if not os.path.exists(path):
+            del _attached[key]
+
+
+def _shared_directory():
+    # /dev/shm is backed by memory, so the files are never written to disk
+    return "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+class SharedArray:
+    """A handle to an array saved once by the parent, which workers open as a
+    read-only memory map.
+
+    The handle only holds the file path, so it is cheap to send to workers with
+    every chunk, and all workers share the pages of one copy of the array.
+    """
+
+    def __init__(self, path, shape, dtype):
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+
+    def attach(self):
+        """Returns the array as a read-only view of the shared file."""
+        if self.path not in _attached:
+            _evict_released()
+            _attached[self.path] = np.load(self.path, mmap_mode="r")
+        return _attached[self.path]
+
+    def paths(self):
+        return [self.path]
+
+    def describe(self):
+        return {"shape": list(self.shape), "dtype": self.dtype}
+
+
+class SharedCSR:
+    """A handle to a CSR matrix whose arrays are SharedArrays.
+
+    Args:
+        data, indices, indptr (SharedArray): The CSR arrays.
+        shape (tuple): The shape of the matrix.
+        content_hash (str): The spectra.content_hash of the matrix, recorded in
+            the metadata of experiments instead of the matrix.
+    """
+
+    def __init__(self, data, indices, indptr, shape, content_hash):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = shape
+        self.content_hash = content_hash
+
+    def attach(self):
+        """Returns the matrix as a csr_matrix over read-only views of the shared
+        arrays."""
+        key = (self.data.path, "csr")
+        if key not in _attached:
+            _evict_released()
+            _attached[key] = csr_matrix(
+                (self.data.attach(), self.indices.attach(), self.indptr.attach()),
+                shape=self.shape,
+                copy=False,
+            )
+        return _attached[key]
+
+    def paths(self):
+        return [self.data.path, self.indices.path, self.indptr.path]
+
+    def describe(self):
+        return {
+            "shape": list(self.shape),
+            "nnz": self.data.shape[0],
+            "content_hash": self.content_hash,
+        }
+
+
+class SharedArrays:
+    """The arrays a Runner shares with its workers, stored as .npy files in a
+    temporary directory (in /dev/shm where available) that is deleted by close.
+
+    Args:
+        directory (str or None): Where to create the temporary directory. None uses
+            /dev/shm, or the default temporary directory without it.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = _shared_directory()
+        self.directory = tempfile.mkdtemp(prefix="random_graphs_", dir=directory)
+        self._count = 0
+
+    def share(self, array):
+        """Saves array and returns its SharedArray handle."""
+        array = np.ascontiguousarray(array)
+        path = os.path.join(self.directory, f"array{self._count}.npy")
+        self._count += 1
+        np.save(path, array)
+        return SharedArray(path, array.shape, str(array.dtype))
+
+    def share_csr(self, matrix):
+        """Saves the arrays of the sparse matrix, in canonical CSR format, and
+        returns its SharedCSR handle."""
+        matrix = csr_matrix(matrix, copy=True)
+        matrix.sum_duplicates()
+        matrix.sort_indices()
+        return SharedCSR(
+            self.share(matrix.data),
+            self.share(matrix.indices),
+            self.share(matrix.indptr),
+            matrix.shape,
+            spectra.content_hash(matrix),
+        )
+
+    def release(self, handle):
+        """Deletes the files of the SharedArray or SharedCSR handle. Workers drop
+        their maps of them the next time they attach to another array."""
+        for path in handle.paths():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,10 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Points the cache of random_graphs at a temporary directory, so the tests
+    never read spectra cached by earlier runs."""
+    cache = tmp_path / "cache"
+    monkeypatch.setenv("RANDOM_GRAPHS_CACHE", str(cache))
+    return cache
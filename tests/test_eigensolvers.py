@@ -0,0 +1,66 @@
+import numpy as np
+
+import random_graphs
+from random_graphs import eigensolvers, seeding
+
+
+def test_deflated_spectrum_is_the_new_spectrum():
+    cover_deg = 5
+    base_graph = np.ones((4, 4)) - np.eye(4)
+    B = random_graphs.random_cover(
+        base_graph=base_graph,
+        cover_deg=cover_deg,
+        permutation_func=random_graphs.permutations.uniform_permutation,
+        identity_shift=0,
+        rng=np.random.default_rng(0),
+    )
+    n = B.shape[0]
+
+    spectrum = np.linalg.eigvalsh(B.toarray())
+    base_eigs = np.linalg.eigvalsh(base_graph)
+    new_eigs = list(spectrum)
+    for eig in base_eigs:
+        new_eigs.pop(int(np.argmin(np.abs(np.array(new_eigs) - eig))))
+
+    deflated = eigensolvers.fiber_deflated_operator(B, cover_deg)
+    deflated_spectrum = np.linalg.eigvalsh(deflated @ np.eye(n))
+    # The projected out subspace adds one zero per base vertex
+    expected = np.sort(np.concatenate([new_eigs, np.zeros(len(base_eigs))]))
+    np.testing.assert_allclose(deflated_spectrum, expected, atol=1e-10)
+
+
+def _sample_rngs(number):
+    entropy = seeding.experiment_entropy(0, "test")
+    return [seeding.sample_rng(entropy, i) for i in range(number)]
+
+
+def test_batched_equals_per_graph_loop_eigs():
+    args = {"size": 200, "deg": 4, "number": 6, "eig_type": "max_positive"}
+    for simple in (True, False):
+        per_graph = random_graphs.generate_loop_extremal_eigs(
+            **args, simple=simple, rng=_sample_rngs(6)
+        )
+        batched = random_graphs.generate_loop_extremal_eigs(
+            **args, simple=simple, batch_size=4, rng=_sample_rngs(6)
+        )
+        np.testing.assert_allclose(batched, per_graph, atol=1e-10)
+
+
+def test_batched_equals_per_graph_new_eigs():
+    args = {
+        "base_graph": np.ones((4, 4)) - np.eye(4),
+        "cover_deg": 100,
+        "permutation_func": random_graphs.permutations.uniform_permutation,
+        "number": 5,
+        "trivial_eig": 3,
+        "eig_type": "max_positive",
+    }
+    per_graph = random_graphs.generate_new_extremal_eigs(**args, rng=_sample_rngs(5))
+    batched = random_graphs.generate_new_extremal_eigs(
+        **args, batch_size=2, rng=_sample_rngs(5)
+    )
+    deflated = random_graphs.generate_new_extremal_eigs(
+        **args, deflate=True, rng=_sample_rngs(5)
+    )
+    np.testing.assert_allclose(batched, per_graph, atol=1e-10)
+    np.testing.assert_allclose(deflated, per_graph, atol=1e-10)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import random_graphs
+from random_graphs import matrix_reps
+
+
+def _k4():
+    return np.ones((4, 4)) - np.eye(4)
+
+
+@pytest.mark.parametrize("identity_shift", [0, 2, -3])
+def test_simple_graph_operator_equals_matrix(identity_shift):
+    args = {"deg": 4, "size": 60, "identity_shift": identity_shift}
+    A = random_graphs.random_simple_graph(**args, rng=np.random.default_rng(1))
+    op = random_graphs.random_simple_graph(
+        **args, as_operator=True, rng=np.random.default_rng(1)
+    )
+    x = np.random.default_rng(2).standard_normal((60, 3))
+    np.testing.assert_allclose(op @ x, A @ x, atol=1e-12)
+
+
+def test_cover_operator_equals_matrix():
+    args = {
+        "base_graph": _k4(),
+        "cover_deg": 7,
+        "permutation_func": random_graphs.permutations.uniform_permutation,
+        "identity_shift": 1,
+    }
+    A = random_graphs.random_cover(**args, rng=np.random.default_rng(3))
+    op = random_graphs.random_cover(
+        **args, as_operator=True, rng=np.random.default_rng(3)
+    )
+    x = np.random.default_rng(4).standard_normal(A.shape[0])
+    np.testing.assert_allclose(op @ x, A @ x, atol=1e-12)
+
+
+def test_group_rep_operator_equals_matrix():
+    base_graph = random_graphs.random_simple_graph(
+        deg=4, size=20, rng=np.random.default_rng(5)
+    )
+    args = {
+        "base_graph": base_graph,
+        "matrix_func": matrix_reps.quaternion_matrix_rep,
+        "identity_shift": -2,
+    }
+    A = random_graphs.random_cover_matrix_rep(**args, rng=np.random.default_rng(6))
+    op = random_graphs.random_cover_matrix_rep(
+        **args, as_operator=True, rng=np.random.default_rng(6)
+    )
+    x = np.random.default_rng(7).standard_normal(A.shape[0])
+    np.testing.assert_allclose(op @ x, A @ x, atol=1e-12)
+
+
+def test_group_rep_tables_are_read_only():
+    matrix = matrix_reps.quaternion_matrix_rep(rng=np.random.default_rng(0))
+    with pytest.raises(ValueError):
+        matrix[0, 0] = 2
@@ -0,0 +1,72 @@
+import sys
+
+import numpy as np
+import pytest
+
+from scripts import loop_graphs
+from scripts.chunk_store import ChunkStore
+from scripts.merge_shards import merge_shards
+from scripts.runner import Runner
+
+NUMBER = 60
+PARAMS = {"size": 100, "deg": 4, "simple": True, "precision": "double"}
+
+# Chunks reaching this sample fail, like a run killed half way. The workers are
+# forked when a Runner is created, so they see the value it had then.
+_FAIL_FROM = None
+
+
+def _interruptible_sample_func(entropy, start_index, stop_index, **params):
+    if _FAIL_FROM is not None and stop_index > _FAIL_FROM:
+        raise RuntimeError("interrupted")
+    return loop_graphs.sample_func(entropy, start_index, stop_index, **params)
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def _run(filename, sample_func=loop_graphs.sample_func, **runner_args):
+    # Short chunks, so every run is split into several of them
+    with Runner(2, target_chunk_seconds=0.01, **runner_args) as runner:
+        results = runner.run(
+            sample_func,
+            filename=filename,
+            number=NUMBER,
+            seed=1,
+            **PARAMS,
+        )
+        return None if results is None else np.array(results)
+
+
+def test_merged_shards_equal_unsharded_run():
+    expected = _run("simple_deg4_V100_N60.npy")
+    merged = "merged/simple_deg4_V100_N60.npy"
+    for shard_index in range(3):
+        assert _run(merged, shard_index=shard_index, num_shards=3) is None
+    merge_shards(merged)
+    np.testing.assert_array_equal(np.load(merged), expected)
+
+
+def test_resumed_equals_uninterrupted_run(monkeypatch):
+    expected = _run("simple_deg4_V100_N60.npy", _interruptible_sample_func)
+    resumed = "resumed/simple_deg4_V100_N60.npy"
+    module = sys.modules[__name__]
+    monkeypatch.setattr(module, "_FAIL_FROM", NUMBER // 2)
+    with pytest.raises(RuntimeError, match="interrupted"):
+        _run(resumed, _interruptible_sample_func)
+    monkeypatch.setattr(module, "_FAIL_FROM", None)
+
+    samples_done = sum(
+        record["stop"] - record["start"] for record in ChunkStore(resumed).records()
+    )
+    assert 0 < samples_done < NUMBER
+    results = _run(resumed, _interruptible_sample_func, resume=True)
+    np.testing.assert_array_equal(results, expected)
+
+
+def test_merge_without_experiment_names_the_directory(tmp_path):
+    (tmp_path / "empty_N10.chunks").mkdir()
+    with pytest.raises(ValueError, match="empty_N10.chunks"):
+        merge_shards("empty_N10.npy")
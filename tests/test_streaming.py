@@ -0,0 +1,29 @@
+import numpy as np
+
+from random_graphs import streaming
+
+
+def test_running_moments_match_numpy():
+    values = np.random.default_rng(0).gamma(2.0, size=10001) + 1e6
+    moments = streaming.RunningMoments()
+    for batch in np.array_split(values, 37):
+        moments.update(batch)
+
+    assert moments.count == len(values)
+    np.testing.assert_allclose(moments.mean, np.mean(values), rtol=1e-14)
+    np.testing.assert_allclose(moments.variance, np.var(values), rtol=1e-10)
+    np.testing.assert_allclose(moments.std, np.std(values), rtol=1e-10)
+
+
+def test_merged_moments_match_numpy():
+    values = np.random.default_rng(1).standard_normal(5000)
+    left, right = streaming.RunningMoments(), streaming.RunningMoments()
+    left.update(values[:1234])
+    right.update(values[1234:])
+    right.update([])
+    left.merge(right)
+
+    np.testing.assert_allclose(left.mean, np.mean(values), atol=1e-14)
+    np.testing.assert_allclose(left.variance, np.var(values), rtol=1e-12)
+    deviation = values - np.mean(values)
+    np.testing.assert_allclose(left._m4 / left.count, np.mean(deviation**4), rtol=1e-12)